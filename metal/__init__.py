@@ -1,7 +1,24 @@
-from .label_model import (
-    RandomVoter,
-    MajorityClassVoter,
-    MajorityLabelVoter,
-    LabelModel,
-)
-from .tuner import ModelTuner
\ No newline at end of file
+import importlib
+
+# The public classes, by the submodule which defines them; these are imported
+# on first access, so that lightweight submodules (e.g. 
+# metal.label_model.predictor) can be imported without torch
+_exports = {
+    'RandomVoter': '.label_model',
+    'MajorityClassVoter': '.label_model',
+    'MajorityLabelVoter': '.label_model',
+    'LabelModel': '.label_model',
+    'BatchedLabelModel': '.label_model',
+    'ModelTuner': '.tuner',
+}
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(_exports[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_exports))
+
+__all__ = list(_exports)
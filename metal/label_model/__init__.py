@@ -1,2 +1,22 @@
-from .baselines import RandomVoter, MajorityClassVoter, MajorityLabelVoter
-from .label_model import LabelModel
\ No newline at end of file
+import importlib
+
+# The public classes, by the submodule which defines them (see metal/__init__)
+_exports = {
+    'RandomVoter': '.baselines',
+    'MajorityClassVoter': '.baselines',
+    'MajorityLabelVoter': '.baselines',
+    'LabelModel': '.label_model',
+    'BatchedLabelModel': '.batched_label_model',
+    'LabelModelPredictor': '.predictor',
+}
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(_exports[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_exports))
+
+__all__ = list(_exports)
@@ -1,7 +1,7 @@
 from collections import Counter
 
 import numpy as np
-from scipy.sparse import csc_matrix
+from scipy.sparse import coo_matrix, csc_matrix, csr_matrix
 import torch
 
 from metal.utils import rargmax
@@ -59,18 +59,46 @@ class MajorityLabelVoter(RandomVoter):
 
     Note that in the case of ties, non-integer probabilities are possible.
     """
-    def train(self, L, **kwargs):
-        pass
+    def train(self, L=None, weights=None, **kwargs):
+        """
+        Args:
+            weights: An optional m-dim array of per-LF vote weights (e.g. 
+                estimated accuracies); if None, each vote has weight 1.
+        """
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            if weights.shape != (self.m,):
+                raise ValueError(f"weights must have shape ({self.m},).")
+        self.weights = weights
 
-    def predict_proba(self, L):
-        L = np.array(L.todense()).astype(int)
-        N, M = L.shape
-        Y_p = np.zeros((N, self.k))
-        for i in range(N):
-            counts = np.zeros(self.k)
-            for j in range(M):
-                if L[i,j]:
-                    counts[L[i,j] - 1] += 1
-            Y_p[i, :] = np.where(counts == max(counts), 1, 0)
+    def predict_proba(self, L, chunk_size=100000):
+        """
+        Args:
+            L: An [N, M] np.ndarray or scipy.sparse matrix of labels, or an
+                iterable of row chunks of one (e.g. of a memory-mapped array)
+            chunk_size: The number of rows of L to process at once
+        Returns:
+            output: A [N, K_t] np.ndarray of soft predictions
+        """
+        return np.vstack([self._get_vote_probs(L_chunk) 
+            for L_chunk in self._iter_row_chunks(L, chunk_size)])
+
+    def _get_vote_probs(self, L):
+        """Returns the uniform distribution over the labels with the most 
+        (weighted) votes in each row of L, in O(nnz)"""
+        L = csr_matrix(L)
+        L.eliminate_zeros()
+        N = L.shape[0]
+
+        # Accumulate the (weighted) votes per row and class
+        rows = np.repeat(np.arange(N), np.diff(L.indptr))
+        weights = getattr(self, 'weights', None)
+        w = np.ones(L.nnz) if weights is None else weights[L.indices]
+        counts = coo_matrix((w, (rows, L.data.astype(np.int64) - 1)), 
+            shape=(N, self.k)).toarray()
+
+        # Split the probability evenly among the tied maximal classes
+        Y_p = np.isclose(counts, counts.max(axis=1).reshape(-1, 1))
+        Y_p = Y_p.astype(float)
         Y_p /= Y_p.sum(axis=1).reshape(-1, 1)
         return Y_p
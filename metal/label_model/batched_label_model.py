@@ -0,0 +1,116 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from metal.label_model.label_model import LabelModel
+from metal.utils import recursive_merge_dicts
+
+
+class BatchedLabelModel(LabelModel):
+    """A batch of independent LabelModels with the same sources, classes, and
+    dependencies, each fit to a different label matrix.
+
+    The models are trained jointly: their overlaps matrices O and params mu are
+    stacked along a leading batch dimension and optimized with batched matmuls
+    in a single training loop, so the per-model Python overhead is paid once.
+
+    Args:
+        m, k, task_graph, deps: As for LabelModel, shared by all models
+        p: np.array: Class balance, either shared by all models (k-dim) or per
+            model (n_models x k)
+    """
+    def __init__(self, m, k=2, task_graph=None, p=None, deps=[], **kwargs):
+        super().__init__(m, k=k, task_graph=task_graph, p=p, deps=deps,
+            **kwargs)
+        self.n_models = None
+        self.p = np.asarray(self.p)
+        if self.p.ndim == 2:
+            self.P = torch.stack([torch.diag(torch.from_numpy(p_i))
+                for p_i in self.p]).float()
+
+    def _get_batch_shape(self):
+        return (self.n_models,)
+
+    def train(self, Ls=None, warm_start=False, **kwargs):
+        """Trains one model per label matrix in Ls (see LabelModel.train)
+
+        Args:
+            Ls: A list of label matrices (each of which may also be an iterable
+                of row chunks); if None, the models are re-fit to their current
+                overlaps matrices
+        """
+        self.config = recursive_merge_dicts(self.config, kwargs,
+            misses='ignore')
+        if self.config['train_config']['n_restarts'] > 1:
+            raise ValueError("BatchedLabelModel does not support n_restarts.")
+
+        # Compute and stack the overlaps matrix of each model
+        if Ls is not None:
+            if self.config['verbose']:
+                print(f"Computing O for {len(Ls)} models...")
+            n_jobs = self.config['train_config']['n_jobs']
+            self.n_models = len(Ls)
+            O, n = [], []
+            for L in Ls:
+                self._generate_O(L, n_jobs=n_jobs)
+                O.append(self.O)
+                n.append(self.n)
+            self.O = torch.stack(O)
+            self.n = np.array(n)
+        elif self.n_models is None:
+            raise ValueError("Ls must be provided when first training a model.")
+        super().train(warm_start=warm_start, **kwargs)
+
+    def add_rows(self, L_new, n_jobs=1):
+        raise NotImplementedError("BatchedLabelModel does not support adding "
+            "rows; re-train with the updated label matrices instead.")
+
+    def add_sources(self, L_cols, L, deps=[]):
+        raise NotImplementedError("BatchedLabelModel does not support adding "
+            "sources; re-train with the updated label matrices instead.")
+
+    def get_label_model(self, i):
+        """Returns the ith model of the batch as a LabelModel
+        
+        The model shares the clique tree and config of the batch, and __init__
+        is bypassed (as in LabelModel.load), so this does not reseed the global
+        random state.
+        """
+        p = self.p[i] if self.p.ndim == 2 else self.p
+        label_model = LabelModel.__new__(LabelModel)
+        nn.Module.__init__(label_model)
+        label_model.config = self.config
+        label_model.seed = self.seed
+        label_model.multitask = False
+        label_model.m = self.m
+        label_model.k = self.k
+        label_model.task_graph = self.task_graph
+        label_model.multi_task = self.multi_task
+        label_model.p = p
+        label_model.P = torch.diag(torch.from_numpy(p)).float()
+        label_model.deps = self.deps
+        label_model.c_tree = self.c_tree
+        label_model.inv_form = self.inv_form
+        label_model.d = self.d
+        label_model.mu = nn.Parameter(self.mu.detach()[i].clone())
+        return label_model
+
+    def _get_label_models(self):
+        """Returns the list of the models of the batch (see get_label_model),
+        built once per value of mu and reused for inference"""
+        state = getattr(self, '_label_models', None)
+        if state is None or state[0] is not self.mu:
+            state = (self.mu, [self.get_label_model(i) 
+                for i in range(self.mu.shape[0])])
+            self._label_models = state
+        return state[1]
+
+    def get_label_probs(self, Ls):
+        """Returns a list of the label probabilities of each model on the
+        corresponding label matrix in Ls"""
+        return [label_model.get_label_probs(L)
+            for label_model, L in zip(self._get_label_models(), Ls)]
+
+    def predict_proba(self, Ls, **kwargs):
+        return [label_model.predict_proba(L, **kwargs)
+            for label_model, L in zip(self._get_label_models(), Ls)]
@@ -1,39 +1,150 @@
+from collections import defaultdict
+import heapq
+
 import networkx as nx
 
 
-def get_clique_tree(nodes, edges):
+def get_clique_tree(nodes, edges, heuristic='min_fill'):
     """Given a set of int nodes i and edges (i,j), returns an nx.Graph object G
     which is a clique tree, where:
         - G.node[i]['members'] contains the set of original nodes in the ith
             maximal clique
         - G[i][j]['members'] contains the set of original nodes in the seperator
             set between maximal cliques i and j
-    
-    Note: This method is currently only implemented for chordal graphs; TODO:
-    add a step to triangulate non-chordal graphs.
+
+    If the graph is not chordal, it is first triangulated (see triangulate),
+    using the given heuristic. The maximal cliques are ordered by their sorted
+    members, so e.g. with no edges the ith maximal clique is {i}.
     """
     # Form the original graph G1
     G1 = nx.Graph()
     G1.add_nodes_from(nodes)
     G1.add_edges_from(edges)
 
-    # Check if graph is chordal
-    # TODO: Add step to triangulate graph if not
-    if not nx.is_chordal(G1):
-        raise NotImplementedError("Graph triangulation not implemented.")
-    
-    # Create maximal clique graph G2
-    # Each node is a maximal clique C_i
-    # Let w = |C_i \cap C_j|; C_i, C_j have an edge with weight w if w > 0
-    G2 = nx.Graph()
-    for i, c in enumerate(nx.chordal_graph_cliques(G1)):
-        G2.add_node(i, members=c)
-    for i in G2.nodes:
-        for j in G2.nodes:
-            S = G2.node[i]['members'].intersection(G2.node[j]['members'])
-            w = len(S)
-            if w > 0:
-                G2.add_edge(i, j, weight=w, members=S)
-    
-    # Return a minimum spanning tree of G2
-    return nx.minimum_spanning_tree(G2)
\ No newline at end of file
+    # Triangulate G1, and read off its maximal cliques
+    _, order = triangulate(G1, heuristic=heuristic)
+    cliques = get_maximal_cliques(G1, order)
+    return get_clique_tree_from_cliques(cliques)
+
+
+def triangulate(G, heuristic='min_fill'):
+    """Triangulates the graph G by greedy vertex elimination, returning a tuple
+    (H, order), where H is a chordal supergraph of G (G plus the fill-in edges)
+    and order is the elimination ordering, which is a perfect elimination
+    ordering of H.
+
+    Args:
+        G: An nx.Graph
+        heuristic: The node eliminated next is the one which minimizes either
+            the number of fill-in edges it adds ('min_fill') or its degree
+            ('min_degree'), with ties broken by node order
+
+    Node scores are kept in a heap and only recomputed for the nodes whose
+    neighborhoods change when a node is eliminated, so for sparse graphs this
+    is roughly O(n log n).
+    """
+    if heuristic == 'min_fill':
+        score = _fill_in
+    elif heuristic == 'min_degree':
+        score = lambda adj, v: len(adj[v])
+    else:
+        raise ValueError(f"Triangulation heuristic {heuristic} not supported.")
+
+    H = G.copy()
+    adj = {v: set(G[v]) - {v} for v in G.nodes}
+    rank = {v: i for i, v in enumerate(G.nodes)}
+    scores = {v: score(adj, v) for v in adj}
+    heap = [(s, rank[v], v) for v, s in scores.items()]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        s, _, v = heapq.heappop(heap)
+        if v not in scores or scores[v] != s:
+            continue
+        del scores[v]
+        order.append(v)
+
+        # Connect the remaining neighbors of v, and remove v
+        nbrs = adj.pop(v)
+        for u in nbrs:
+            adj[u].discard(v)
+            fill = nbrs - adj[u] - {u}
+            adj[u] |= fill
+            H.add_edges_from((u, w) for w in fill)
+
+        # Update the scores of the nodes whose neighborhoods changed
+        if heuristic == 'min_fill':
+            affected = set(nbrs).union(*(adj[u] for u in nbrs))
+        else:
+            affected = nbrs
+        for u in affected:
+            s_u = score(adj, u)
+            if s_u != scores[u]:
+                scores[u] = s_u
+                heapq.heappush(heap, (s_u, rank[u], u))
+    return H, order
+
+
+def _fill_in(adj, v):
+    """Returns the number of edges missing between the neighbors of v"""
+    nbrs = adj[v]
+    missing = sum(len(nbrs - adj[u]) - 1 for u in nbrs)
+    return missing // 2
+
+
+def get_maximal_cliques(G, order):
+    """Returns the maximal cliques of the triangulation of G defined by the
+    elimination ordering order (e.g. from triangulate), as a list of sets
+    sorted by their sorted members.
+
+    Each node v defines a clique C_v = {v} + its later neighbors in the
+    triangulation; C_v is not maximal iff some node u has v as its earliest
+    later neighbor and |C_u| = |C_v| + 1.
+    """
+    pos = {v: i for i, v in enumerate(order)}
+    adj = {v: set(G[v]) - {v} for v in G.nodes}
+    later = {}
+    for v in order:
+        later[v] = {u for u in adj[v] if pos[u] > pos[v]}
+        for u in later[v]:
+            adj[u] |= later[v] - {u}
+    non_maximal = set()
+    for u in order:
+        if later[u]:
+            v = min(later[u], key=pos.get)
+            if len(later[u]) == len(later[v]) + 1:
+                non_maximal.add(v)
+    cliques = [later[v] | {v} for v in order if v not in non_maximal]
+    return sorted(cliques, key=sorted)
+
+
+def get_clique_tree_from_cliques(cliques):
+    """Returns a clique tree (see get_clique_tree) over the given maximal
+    cliques of a chordal graph, i.e. a maximum-weight spanning tree (forest)
+    of the clique graph in which cliques C_i, C_j are connected with weight
+    w = |C_i \cap C_j| if w > 0.
+
+    Only pairs of cliques which share a member are considered, using an
+    inverted index from nodes to the cliques containing them, so with few
+    dependencies this is roughly linear rather than quadratic in the number
+    of cliques.
+    """
+    G = nx.Graph()
+    node_cliques = defaultdict(list)
+    for i, c in enumerate(cliques):
+        G.add_node(i, members=set(c))
+        for v in c:
+            node_cliques[v].append(i)
+
+    # Find the candidate edges via the inverted index
+    pairs = set()
+    for idxs in node_cliques.values():
+        for a, i in enumerate(idxs):
+            for j in idxs[a+1:]:
+                pairs.add((i, j))
+    for i, j in pairs:
+        S = G.nodes[i]['members'] & G.nodes[j]['members']
+        G.add_edge(i, j, weight=len(S), members=S)
+
+    # Return a maximum spanning tree of the clique graph
+    return nx.maximum_spanning_tree(G)
@@ -1,7 +1,16 @@
-from itertools import product, chain
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import json
+import multiprocessing as mp
+import os
+import time
 
+import networkx as nx
 import numpy as np
-from scipy.sparse import issparse, csc_matrix
+from scipy.sparse import (
+    issparse, csc_matrix, csr_matrix, coo_matrix, hstack, diags
+)
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -16,6 +25,15 @@ from metal.classifier import Classifier
 from metal.label_model.lm_defaults import lm_model_defaults
 from metal.utils import recursive_merge_dicts
 from metal.label_model.graph_utils import get_clique_tree
+from metal.label_model.structure_learning import learn_deps
+from metal.label_model.predictor import (
+    LabelModelPredictor,
+    PredictionCache,
+    get_multi_task_indicators,
+    get_row_keys,
+    get_unary_scores,
+    normalize_scores,
+)
 
 
 class LabelModel(Classifier):
@@ -68,58 +86,39 @@ class LabelModel(Classifier):
         pattern.
         
         Args:
-            - L: A dense n x m numpy array, where n is the number of data points
-                and m is the number of sources, with values in {0,1,...,k}
+            - L: An n x m numpy array or scipy.sparse matrix, where n is the
+                number of data points and m is the number of sources, with
+                values in {0,1,...,k}
             - offset: Create indicators for values {offset,...,k}
+
+        Returns:
+            - L_aug: An n x d scipy.sparse.csr_matrix of integer indicators
         """
         # TODO: Handle in cleaner way
         if self.multi_task:
-            t = len(L)
             n, m = L[0].shape
         else:
-            t = 1
             n, m = L.shape
         km = self.k + 1 - offset
 
-        # Create a helper data structure which maps cliques (as tuples of member
-        # sources) --> {start_index, end_index, maximal_cliques}, where
-        # the last value is a set of indices in this data structure
-        self.c_data = {}
-        for i in range(m):
-            self.c_data[i] = {
-                'start_index': i*km,
-                'end_index': (i+1)*km,
-                'max_cliques': set([j for j in self.c_tree.nodes() 
-                    if i in self.c_tree.node[j]['members']])
-            }
-
         # Form the columns corresponding to unary source labels
         if self.multi_task:
-            L_aug = np.ones((n, m * km))
-
             # TODO: By default, this will operate with offset = 1 by skipping
             # abstains; should fix this!
-            for yi, y in enumerate(self.task_graph.feasible_set()):
-                for s in range(t):
-                    # Note that we cast to dense here, and are creating a dense
-                    # matrix; can change to fully sparse operations if needed
-                    L_s = L[s].todense()
-                    L_aug[:, yi::km] *= np.where(
-                        np.logical_or(L_s == y[s], L_s == 0), 1, 0)
-                
-                # Handle abstains- if all elements of the task label are 0
-                L_aug[:, yi::km] *= np.where(
-                    sum(map(abs, L)).todense() != 0, 1, 0)
+            L_aug = self._get_multi_task_indicators(L, km)
 
         else:
-            L_aug = np.zeros((n, m * km))
-            for y in range(offset, self.k+1):
-                L_aug[:, y-offset::km] = np.where(L == y, 1, 0)
+            L_aug = self._get_unary_indicators(L, km, offset)
         
         # Get the higher-order clique statistics based on the clique tree
         # First, iterate over the maximal cliques (nodes of c_tree) and
         # separator sets (edges of c_tree)
         if higher_order:
+            self._set_c_data(m, km)
+            L_unary = L_aug.tocsc()
+            L_aug = L_aug.tocoo()
+            rows, cols = [L_aug.row], [L_aug.col]
+            d = L_aug.shape[1]
             for item in chain(self.c_tree.nodes(), self.c_tree.edges()):
                 if isinstance(item, int):
                     C = self.c_tree.node[item]
@@ -139,15 +138,13 @@ class LabelModel(Classifier):
                 
                 # Else add one column for each possible value
                 else:
-                    L_C = np.ones((n, km ** nc))
-                    for i, vals in enumerate(product(range(km), repeat=nc)):
-                        for j, v in enumerate(vals):
-                            L_C[:,i] *= L_aug[:, members[j]*km + v]
-
-                    # Add to L_aug and store the indices
-                    C['start_index'] = L_aug.shape[1]
-                    C['end_index'] = L_aug.shape[1] + L_C.shape[1]
-                    L_aug = np.hstack([L_aug, L_C])
+                    rows_C, cols_C = self._get_clique_indicators(L_unary,
+                        members, km)
+                    rows.append(rows_C)
+                    cols.append(d + cols_C)
+                    C['start_index'] = d
+                    C['end_index'] = d + km ** nc
+                    d += km ** nc
                 
                 # Add to self.c_data as well
                 self.c_data[tuple(members)] = {
@@ -155,30 +152,293 @@ class LabelModel(Classifier):
                     'end_index': C['end_index'],
                     'max_cliques': set([item]) if C_type=='node' else set(item)
                 }
+
+            # Assemble the unary and all clique blocks in a single allocation
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            L_aug = csr_matrix((np.ones(len(rows), dtype=np.int64), 
+                (rows, cols)), shape=(n, d))
         return L_aug
+
+    def _get_clique_indicators(self, L_unary, members, km):
+        """Returns the (row, column) indices of the nonzero entries of the
+        n x km^nc indicator block of a clique, where column 
+        sum_j v_j * km^(nc-1-j) indicates that member j voted value v_j (i.e.
+        column members[j] * km + v_j of L_unary), for each combination of the
+        members' votes in a row.
+        
+        Args:
+            - L_unary: The n x (m * km) unary indicator matrix, in csc format
+            - members: The list of nc sources in the clique
+            - km: The number of indicator columns per source
+        """
+        # Encode each row's joint clique value as one integer, one member at a
+        # time, expanding each partial code by every vote of the next member
+        n = L_unary.shape[0]
+        rows = np.arange(n)
+        codes = np.zeros(n, dtype=np.int64)
+        for i in members:
+            L_i = L_unary[:, i*km:(i+1)*km].tocsr()
+            counts = np.diff(L_i.indptr)[rows]
+            offsets = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+            vals = L_i.indices[np.repeat(L_i.indptr[rows], counts) + offsets]
+            rows = np.repeat(rows, counts)
+            codes = np.repeat(codes, counts) * km + vals
+        return rows, codes
+
+    def _set_c_data(self, m, km):
+        """Create a helper data structure which maps cliques (as tuples of 
+        member sources) --> {start_index, end_index, maximal_cliques}, where
+        the last value is a set of indices in this data structure"""
+        max_cliques = {i: set() for i in range(m)}
+        for j in self.c_tree.nodes():
+            for i in self.c_tree.node[j]['members']:
+                max_cliques[i].add(j)
+        self.c_data = {}
+        for i in range(m):
+            self.c_data[i] = {
+                'start_index': i*km,
+                'end_index': (i+1)*km,
+                'max_cliques': max_cliques[i]
+            }
+
+    def _get_unary_indicators(self, L, km, offset=1):
+        """Returns the n x (m * km) sparse indicator matrix of the unary source
+        labels, built directly from the entries of L with value >= offset.
+
+        Each entry L[i,j] = y >= offset becomes a single 1 in column
+        j * km + (y - offset), so for offset >= 1 memory scales with the number
+        of non-abstain votes rather than with n * m * km.
+        """
+        n, m = L.shape
+        if offset > 0:
+            # Abstains (0) are never indicated, so only the stored entries of a
+            # sparse matrix are needed
+            L_coo = coo_matrix(L)
+            rows, cols = L_coo.row, L_coo.col
+            vals = L_coo.data.astype(np.int64)
+        else:
+            # Abstains are indicated as well, so every entry is needed
+            L_dense = np.asarray(L.todense() if issparse(L) else L)
+            rows, cols = np.indices((n, m)).reshape(2, -1)
+            vals = L_dense.ravel().astype(np.int64)
+
+        # Drop any explicitly stored values outside {offset,...,k} (e.g. zeros)
+        keep = (vals >= offset) & (vals < offset + km)
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+        return csr_matrix(
+            (np.ones(len(vals), dtype=np.int64), 
+            (rows, cols * km + vals - offset)),
+            shape=(n, m * km)
+        )
     
-    def _generate_O(self, L):
+    def _get_multi_task_indicators(self, L, km):
+        """Returns the n x (m * km) sparse indicator matrix of the multi-task
+        source labels (see predictor.get_multi_task_indicators)"""
+        return get_multi_task_indicators(L, self._get_feasible_set())
+
+    def _get_feasible_set(self):
+        """Returns the feasible set of the task graph as a k x t array"""
+        return self.task_graph.feasible_array
+
+    def _is_chunked(self, L):
+        """Returns True if L is an iterable of row chunks of a label matrix
+        (e.g. a generator over sparse shards or blocks of a memory-mapped
+        array), rather than a single label matrix"""
+        if self.multi_task:
+            # A single multi-task label matrix is a list of t matrices
+            return not (isinstance(L, list) and 
+                all(isinstance(L_s, np.ndarray) or issparse(L_s) for L_s in L))
+        else:
+            return not (isinstance(L, np.ndarray) or issparse(L))
+
+    def _deduplicate_rows(self, L):
+        """Collapses L into its unique rows (i.e. the distinct patterns of
+        source votes) and their multiplicities.
+
+        Each row is hashed to a pair of random 64-bit keys computed from its
+        nonzero entries, so this costs O(nnz + n log n) for dense or sparse L.
+
+        Returns:
+            - L_unique: The n_unique unique rows of L, as a csr_matrix (or, if
+                multi-task, a list of t csr_matrix)
+            - inverse: An n-dim array such that L[i] == L_unique[inverse[i]]
+            - counts: An n_unique-dim array of the multiplicity of each row
+        """
+        # Treat the t task label matrices as one n x (t * m) matrix
+        if self.multi_task:
+            L = hstack([csr_matrix(L_s) for L_s in L], format='csr')
+        else:
+            L = csr_matrix(L, copy=True)
+        L.sum_duplicates()
+        L.eliminate_zeros()
+        n, m = L.shape
+
+        # Each (column, value) pair gets a code and two random 64-bit weights,
+        # and each row is keyed by the (wrapping) sums of its entries' weights
+        vals = L.data.astype(np.int64)
+        vals -= vals.min(initial=0)
+        n_vals = vals.max(initial=0) + 1
+        codes = L.indices.astype(np.int64) * n_vals + vals
+        rs = np.random.RandomState(0)
+        keys = np.zeros((n, 2), dtype=np.uint64)
+        for i in range(2):
+            w = rs.randint(0, 2**63, size=m * n_vals, dtype=np.int64)
+            cs = np.zeros(len(codes) + 1, dtype=np.uint64)
+            np.cumsum(w.astype(np.uint64)[codes], out=cs[1:])
+            keys[:, i] = cs[L.indptr[1:]] - cs[L.indptr[:-1]]
+        _, index, inverse, counts = np.unique(keys, axis=0, return_index=True,
+            return_inverse=True, return_counts=True)
+        L_unique = L[index]
+        if self.multi_task:
+            L_unique = L_unique.tocsc()
+            t = len(self.task_graph.K_t)
+            L_unique = [csr_matrix(L_unique[:, s*self.m:(s+1)*self.m])
+                for s in range(t)]
+        return L_unique, inverse.ravel(), counts
+
+    def _get_overlap_counts(self, L, start_col=0):
+        """Returns the unnormalized overlaps matrix L_aug^T L_aug as a dense 
+        integer array, along with the number of rows n of L
+        
+        If start_col > 0, only the columns L_aug^T L_aug[:, start_col:] are
+        computed.
+        """
+        n = L[0].shape[0] if self.multi_task else L.shape[0]
+
+        # Compute the overlaps as a weighted sum over the unique rows of L
+        if self.config['deduplicate_rows']:
+            L, _, counts = self._deduplicate_rows(L)
+            L_aug = self._get_augmented_label_matrix(L, offset=1)
+            L_aug_w = diags(counts, dtype=np.int64) @ L_aug
+        else:
+            L_aug = L_aug_w = self._get_augmented_label_matrix(L, offset=1)
+        if start_col > 0:
+            L_aug_w = L_aug_w.tocsc()[:, start_col:]
+
+        # The sparse product gives the integer co-occurrence counts directly
+        return (L_aug.T @ L_aug_w).toarray(), n
+
+    def _generate_O(self, L, n_jobs=1):
         """Form the overlaps matrix, which is just all the different observed
         combinations of values of pairs of sources
 
         Note that we only include the k non-abstain values of each source,
         otherwise the model not minimal --> leads to singular matrix
+
+        Args:
+            - L: A label matrix, or an iterable of row chunks of one; in the
+                latter case the unnormalized counts are accumulated chunk by
+                chunk, so peak memory is bounded by the chunk size
+            - n_jobs: The number of processes over which to shard the rows of
+                L (or the chunks); -1 uses all available cores
         """
-        # TODO: Handle in cleaner way
-        if self.multi_task:
-            self.t = len(L)
-            self.n, self.m = L[0].shape
-        else:
-            self.t = 1
-            self.n, self.m = L.shape
-        L_aug = self._get_augmented_label_matrix(L, offset=1)
-        self.d = L_aug.shape[1]
-        self.O = torch.from_numpy( L_aug.T @ L_aug / self.n ).float()
+        self.t = len(self.task_graph.K_t) if self.multi_task else 1
+        self.overlaps = OverlapStatistics(self)
+        self.overlaps.add_rows(L, n_jobs=n_jobs)
+        self._update_O()
+
+    def _update_O(self):
+        """Sets O (and n, d, c_data) from the overlap statistics self.overlaps"""
+        self._set_c_data(self.m, self.k)
+        self.n = self.overlaps.n
+        self.d = self.overlaps.counts.shape[0]
+        self.O = torch.from_numpy(self.overlaps.counts / self.n).float()
     
-    def _generate_O_inv(self, L):
-        """Form the *inverse* overlaps matrix"""
-        self._generate_O(L)
-        self.O_inv = torch.from_numpy(np.linalg.inv(self.O.numpy())).float()
+    def _generate_O_inv(self):
+        """Form the *inverse* overlaps matrix
+
+        Since O is symmetric PSD, O^{-1} is computed from its (cached)
+        eigendecomposition O + ridge I = V diag(w) V^T, which is reused in
+        get_Q, and gives the condition number of O directly. If O is singular
+        or its condition number exceeds inv_max_cond, a ValueError is raised
+        here, rather than the inverse-form losses diverging during training.
+        """
+        ridge = self.config['train_config']['inv_ridge']
+        max_cond = self.config['train_config']['inv_max_cond']
+        w, V = np.linalg.eigh(self.O.double().numpy())
+        w = w + ridge
+        w_min, w_max = w[..., 0], w[..., -1]
+        with np.errstate(divide='ignore'):
+            cond = np.where(w_min > 0, w_max / w_min, np.inf)
+        self.O_inv_stats = {'cond': cond, 'min_eig': w_min, 'max_eig': w_max,
+            'ridge': ridge}
+        if max_cond is not None and np.any(cond > max_cond):
+            raise ValueError(f"O is ill-conditioned (condition number "
+                f"{np.max(cond):.3g} > inv_max_cond={max_cond:.3g}); consider "
+                f"setting inv_ridge > 0 or removing low-coverage sources.")
+        self._O_eig = (w, V)
+        O_inv = (V / w[..., None, :]) @ np.swapaxes(V, -2, -1)
+        self.O_inv = torch.from_numpy(O_inv).float()
+
+    def add_rows(self, L_new, n_jobs=1):
+        """Adds the rows L_new to the overlaps matrix O, computing only their
+        overlap counts; call train(warm_start=True) afterwards to re-fit."""
+        self.overlaps.add_rows(L_new, n_jobs=n_jobs)
+        self._update_O()
+
+    def add_sources(self, L_cols, L, deps=[]):
+        """Adds new sources with labels L_cols to the overlaps matrix O, 
+        computing only the new blocks of O; call train(warm_start=True) 
+        afterwards to re-fit.
+
+        Args:
+            - L_cols: An n x m_new label matrix of the new sources (or a list of
+                t of these, if multi-task)
+            - L: The n x m label matrix of the current sources, for all of the
+                rows the model was fit to (including any added by add_rows), 
+                in order; it is not retained by the model
+            - deps: A list of any additional source dependencies, where the
+                new sources have indices m,...,m + m_new - 1
+        """
+        n, m = L[0].shape if self.multi_task else L.shape
+        if (n, m) != (self.n, self.m):
+            raise ValueError(f"L has shape {(n, m)}, but the model was fit "
+                f"to {self.n} rows of {self.m} sources.")
+        m_new = L_cols[0].shape[1] if self.multi_task else L_cols.shape[1]
+        self.m += m_new
+        self.deps = self.deps + list(deps)
+        self.c_tree = get_clique_tree(range(self.m), self.deps)
+        self.inv_form = (len(self.deps) > 0)
+        self.overlaps.add_sources(L_cols, L)
+        self._update_O()
+
+    def learn_deps(self, L=None, n_jobs=1, **kwargs):
+        """Returns candidate source dependencies estimated from the overlaps
+        matrix O (see structure_learning.learn_deps), e.g. to pass as deps to 
+        a new LabelModel or to add_sources
+
+        Args:
+            - L: A label matrix, or an iterable of row chunks of one, from 
+                which to compute O; if None, the O of the current overlap
+                statistics (e.g. from the last call to train) is reused
+            - n_jobs: The number of processes used to compute O
+            - kwargs: Passed to structure_learning.learn_deps
+        """
+        if L is not None:
+            self._generate_O(L, n_jobs=n_jobs)
+        elif not hasattr(self, 'O'):
+            raise ValueError("L must be provided if O has not been computed.")
+        if self.O.dim() != 2:
+            raise ValueError("Structure learning requires a single model.")
+        return learn_deps(self.O.double().numpy(), self.m, self.k, **kwargs)
+
+    def _warm_start(self, params):
+        """Initializes the learned params from the values of a previous fit;
+        rows for sources added since then keep their default initialization.
+        
+        If the params have a leading dimension of restarts (but the previous 
+        values do not), only the first restart is warm-started, so the others
+        keep their random initializations.
+        """
+        with torch.no_grad():
+            for name, value in params.items():
+                param = getattr(self, name, None)
+                if param is not None and param.shape[-1] == value.shape[-1]:
+                    d = min(param.shape[-2], value.shape[-2])
+                    if param.dim() > value.dim():
+                        param = param[0]
+                    param[..., :d, :] = value[..., :d, :]
     
     def _init_params(self):
         """Initialize the learned params
@@ -192,29 +452,162 @@ class LabelModel(Classifier):
         and similarly for higher-order cliques.
         - Z is the inverse form version of \mu.
         - mask is the mask applied to O^{-1}, O for the matrix approx constraint
+
+        If n_restarts > 1, mu and Z are initialized with a leading dimension of
+        n_restarts independent initializations.
         """
         # Initialize mu so as to break basic reflective symmetry
         # TODO: Update for higher-order cliques!
-        self.mu_init = torch.zeros(self.d, self.k)
-        for i in range(self.m):
-            for y in range(self.k):
-                self.mu_init[i*self.k + y, y] += np.random.random()
+        # If n_restarts > 1, the params have a leading dimension of restarts,
+        # which are optimized jointly as a batch
+        batch = self._get_batch_shape()
+        self.mu_init = torch.zeros(*batch, self.d, self.k)
+        rows = np.arange(self.m * self.k)
+        cols = np.tile(np.arange(self.k), self.m)
+        method = self.config['train_config']['mu_init_method']
+        if method == 'moments':
+            # Seed mu from closed-form estimates, and jitter any additional
+            # restarts so that they differ
+            self.mu_init[..., :self.m * self.k, :] += torch.from_numpy(
+                self._get_moments_init()).float()
+            if self.config['train_config']['n_restarts'] > 1:
+                self.mu_init[1:, rows, cols] += 0.1 * torch.from_numpy(
+                    np.random.random(batch + (self.m * self.k,))[1:]).float()
+        elif method == 'random':
+            self.mu_init[..., rows, cols] += torch.from_numpy(
+                np.random.random(batch + (self.m * self.k,))).float()
+        else:
+            raise ValueError(f"Unrecognized mu_init_method: {method}")
         self.mu = nn.Parameter(self.mu_init.clone()).float()
 
         if self.inv_form:
-            self.Z = nn.Parameter(torch.randn(self.d, self.k)).float()
-
-        self.mask = torch.ones(self.d, self.d).byte()
-        for ci in self.c_data.values():
-            si, ei = ci['start_index'], ci['end_index']
-            for cj in self.c_data.values():
-                sj, ej = cj['start_index'], cj['end_index']
-
-                # Check if ci and cj are part of the same maximal clique
-                # If so, mask out their corresponding blocks in O^{-1}
-                if len(ci['max_cliques'].intersection(cj['max_cliques'])) > 0:
-                    self.mask[si:ei, sj:ej] = 0
-                    self.mask[sj:ej, si:ei] = 0
+            self.Z = nn.Parameter(torch.randn(*batch, self.d, self.k)).float()
+
+        # Mask out the blocks of O^{-1}, O corresponding to pairs of cliques
+        # which are part of the same maximal clique
+        blocks = self._get_clique_blocks()
+        self.mask_idx = self._get_mask_idx(blocks)
+        if not self.config['train_config']['low_rank_loss']:
+            shared = np.zeros((len(blocks['sizes']),)*2, dtype=bool)
+            shared[blocks['pairs'][0], blocks['pairs'][1]] = True
+            ids = blocks['block_ids']
+            self.mask = torch.from_numpy(
+                (~shared[ids][:, ids]).astype(np.uint8))
+
+    def _estimate_accuracies(self, n_iter=20):
+        """Returns closed-form (method-of-moments) estimates of the coverage 
+        P(\lambda_i != 0) and accuracy P(\lambda_i = Y | \lambda_i != 0) of
+        each source from the unary blocks of O, as a tuple of arrays with the
+        leading batch dimensions of O.
+
+        Assuming the errors of each source are spread evenly over the other
+        classes, and conditionally independent sources i, j, their agreement
+        rate when both vote is 1/k + (k-1)/k * a_i * a_j, where 
+        a_i = (k * acc_i - 1) / (k - 1). The resulting matrix of a_i * a_j is
+        observed for the pairs of overlapping sources not sharing a clique, so
+        a is estimated from the leading eigenpair (lambda, v) of this matrix as
+        a = sqrt(lambda) * v, filling in its unobserved entries (including the
+        diagonal) from the previous estimate of a a^T on each iteration, with
+        the sign chosen so that sources are better than random on average.
+        """
+        if self.multi_task:
+            raise ValueError("Moments init requires a single-task LabelModel.")
+        m, k = self.m, self.k
+        O = self.O.double().numpy()[..., :m*k, :m*k]
+        B = O.reshape(O.shape[:-2] + (m, k, m, k))
+        coverage = np.einsum('...iaia->...i', B)
+        both = B.sum(axis=(-3, -1))
+        agree = np.einsum('...iaja->...ij', B)
+
+        # The pairs of sources with observed (and uncorrelated) agreement rates
+        shared = np.eye(m, dtype=bool)
+        for i in self.c_tree.nodes():
+            members = list(self.c_tree.node[i]['members'])
+            shared[np.ix_(members, members)] = True
+        observed = (both > 0) & ~shared
+        with np.errstate(divide='ignore', invalid='ignore'):
+            M = np.where(observed, (k * agree / both - 1) / (k - 1), 0)
+
+        # Fit M ~ a a^T on the observed entries
+        a = np.zeros(coverage.shape)
+        for _ in range(n_iter):
+            X = np.where(observed, M, a[..., :, None] * a[..., None, :])
+            w, V = np.linalg.eigh(X)
+            a = np.sqrt(np.clip(w[..., -1:], 0, None)) * V[..., -1]
+            a *= np.where(a.sum(axis=-1, keepdims=True) < 0, -1, 1)
+        a = np.clip(a, 0.05, 0.98)
+        accuracy = (1 + (k - 1) * a) / k
+        return coverage, accuracy
+
+    def _get_moments_init(self):
+        """Returns the m*k x k unary block of mu implied by the coverage and
+        accuracy estimates of _estimate_accuracies, i.e. with
+        
+            mu[i*k + j, y] = cov_i * (acc_i if j == y else (1-acc_i) / (k-1))
+        """
+        m, k = self.m, self.k
+        coverage, accuracy = self._estimate_accuracies()
+        I = np.eye(k)
+        acc = accuracy[..., None, None]
+        mu = coverage[..., None, None] * (acc * I + (1 - acc) / (k - 1) * 
+            (1 - I))
+        return mu.reshape(mu.shape[:-3] + (m * k, k))
+
+    def _get_batch_shape(self):
+        """Returns the shape of the leading batch dimensions of the params"""
+        n_restarts = self.config['train_config']['n_restarts']
+        return (n_restarts,) if n_restarts > 1 else ()
+
+    def _get_clique_blocks(self):
+        """Returns a block-index representation of the clique structure over
+        the columns of O / mu, where each entry of self.c_data is a block of 
+        contiguous columns, as a dict of:
+            - starts, sizes: The start index and number of columns per block
+            - block_ids: A d-dim array of the block ID of each column
+            - pairs: A 2 x n_pairs array of all (ordered) pairs of blocks which
+                are part of the same maximal clique, including (b, b)
+        
+        This depends only on the sources, k, and deps, so is cached and reused
+        across calls to train.
+        """
+        if getattr(self, '_clique_blocks', {}).get('d') == self.d:
+            return self._clique_blocks
+
+        c_data = sorted(self.c_data.values(), key=lambda c: c['start_index'])
+        starts = np.array([c['start_index'] for c in c_data])
+        sizes = np.array([c['end_index'] - c['start_index'] for c in c_data])
+        block_ids = np.repeat(np.arange(len(c_data)), sizes)
+
+        # Two blocks share a maximal clique iff their entry in the product of
+        # the block x maximal clique incidence matrix with itself is nonzero
+        rows = [b for b, c in enumerate(c_data) for _ in c['max_cliques']]
+        cols = [j for c in c_data for j in c['max_cliques']]
+        n_cliques = max(cols) + 1 if cols else 0
+        B = csr_matrix((np.ones(len(rows)), (rows, cols)), 
+            shape=(len(c_data), n_cliques))
+        pairs = np.vstack((B @ B.T).nonzero())
+
+        self._clique_blocks = {
+            'd': self.d,
+            'starts': starts,
+            'sizes': sizes,
+            'block_ids': block_ids,
+            'pairs': pairs,
+        }
+        return self._clique_blocks
+
+    def _get_mask_idx(self, blocks):
+        """Returns the (row, column) indices of all the entries of the blocks 
+        of O masked out by the given block pairs, as a tuple of LongTensors"""
+        b1, b2 = blocks['pairs']
+        s1, s2 = blocks['sizes'][b1], blocks['sizes'][b2]
+        counts = s1 * s2
+        pair = np.repeat(np.arange(len(b1)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        I = blocks['starts'][b1][pair] + offsets // s2[pair]
+        J = blocks['starts'][b2][pair] + offsets % s2[pair]
+        return torch.from_numpy(I).long(), torch.from_numpy(J).long()
     
     def get_conditional_probs(self, source=None):
         """Returns the full conditional probabilities table as a numpy array,
@@ -229,85 +622,387 @@ class LabelModel(Classifier):
         
         If `source` is not None, returns only the corresponding block.
         """
-        c_probs = np.zeros((self.m * (self.k+1), self.k))
+        # mu may have leading batch dimensions (see BatchedLabelModel)
         mu = self.mu.detach().clone().numpy()
-        
-        for i in range(self.m):
-            # si = self.c_data[(i,)]['start_index']
-            # ei = self.c_data[(i,)]['end_index']
-            # mu_i = mu[si:ei, :]
-            mu_i = mu[i*self.k:(i+1)*self.k, :]
-            c_probs[i*(self.k+1) + 1:(i+1)*(self.k+1), :] = mu_i 
-            
-            # The 0th row (corresponding to abstains) is the difference between
-            # the sums of the other rows and one, by law of total prob
-            c_probs[i*(self.k+1), :] = 1 - mu_i.sum(axis=0)
+        batch = mu.shape[:-2]
+        mu = mu[..., :self.m*self.k, :].reshape(batch + (self.m, self.k, self.k))
+        c_probs = np.zeros(batch + (self.m, self.k+1, self.k))
+        c_probs[..., 1:, :] = mu
+
+        # The 0th row (corresponding to abstains) is the difference between
+        # the sums of the other rows and one, by law of total prob
+        c_probs[..., 0, :] = 1 - mu.sum(axis=-2)
+        c_probs = c_probs.reshape(batch + (self.m * (self.k+1), self.k))
         c_probs = np.clip(c_probs, 0.01, 0.99)
     
         if source is not None:
-            return c_probs[source*(self.k+1):(source+1)*(self.k+1)]
+            return c_probs[..., source*(self.k+1):(source+1)*(self.k+1), :]
         else:
             return c_probs
 
-    def predict_proba(self, L):
-        return self.get_label_probs(L)
+    def _slice_rows(self, L, start, end):
+        """Returns rows start:end of the label matrix L"""
+        if self.multi_task:
+            return [L_s[start:end] for L_s in L]
+        else:
+            return L[start:end]
+
+    def _iter_row_chunks(self, L, chunk_size):
+        """Yields consecutive blocks of (at most) chunk_size rows of L, or the
+        chunks of L themselves if L is already an iterable of row chunks"""
+        if self._is_chunked(L):
+            yield from L
+            return
+
+        # Row slicing requires CSR format for sparse matrices
+        if self.multi_task:
+            L = [csr_matrix(L_s) if issparse(L_s) else L_s for L_s in L]
+            n = L[0].shape[0]
+        else:
+            L = csr_matrix(L) if issparse(L) else L
+            n = L.shape[0]
+        for start in range(0, n, chunk_size):
+            yield self._slice_rows(L, start, start + chunk_size)
+
+    def predict_proba_iter(self, L, chunk_size=100000, n_threads=1):
+        """Yields the label probabilities for consecutive row blocks of L
+        
+        Args:
+            - L: A label matrix (e.g. a memory-mapped array), or an iterable
+                of row chunks of one
+            - chunk_size: The number of rows of L per block
+            - n_threads: The number of threads over which to split the blocks;
+                at most 2 * n_threads blocks are in flight at once
+        """
+        chunks = self._iter_row_chunks(L, chunk_size)
+        if n_threads == 1:
+            for L_chunk in chunks:
+                yield self.get_label_probs(L_chunk)
+            return
+
+        # Inference only reads the state captured after training (and the
+        # NumPy / SciPy kernels release the GIL), so the blocks of rows can be
+        # processed concurrently
+        self._get_log_prob_tables()
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            futures = deque()
+            for L_chunk in chunks:
+                futures.append(pool.submit(self.get_label_probs, L_chunk))
+                if len(futures) >= 2 * n_threads:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    def predict_proba(self, L, out=None, chunk_size=100000, 
+        marginalize=False, n_threads=1):
+        """Returns the n x k matrix of label probabilities P(Y | \lambda)
+
+        Inference has no side effects on the model, so a trained LabelModel
+        may be shared by concurrent callers (e.g. a thread pool). If 
+        config['prediction_cache_size'] > 0, the probabilities of recently seen
+        row vote patterns are cached (see prediction_cache_info).
+
+        Args:
+            - L: A label matrix, or an iterable of row chunks of one
+            - out: An optional preallocated (e.g. np.memmap) n x k array; if
+                provided, L is processed in row blocks of chunk_size, and the
+                probabilities are written into (and returned as) out
+            - chunk_size: The number of rows of L per block
+            - marginalize: If True (multi-task only), instead return a T-length
+                list of the n x K_t matrices of per-task marginals (see 
+                predict_task_proba)
+            - n_threads: The number of threads over which to split the row 
+                blocks of L (see predict_proba_iter)
+        """
+        if marginalize:
+            Y_p = self.predict_proba(L, out=out, chunk_size=chunk_size, 
+                n_threads=n_threads)
+            Y_tp = self._marginalize(Y_p)
+            offsets = self._get_task_aggregation_matrix()[1]
+            return [Y_tp[:, offsets[t]:offsets[t+1]] 
+                for t in range(len(offsets) - 1)]
+
+        if out is None:
+            if self._is_chunked(L) or n_threads > 1:
+                return np.vstack(list(self.predict_proba_iter(L, 
+                    chunk_size=chunk_size, n_threads=n_threads)))
+            return self.get_label_probs(L)
+        
+        start = 0
+        for Y_p in self.predict_proba_iter(L, chunk_size=chunk_size, 
+            n_threads=n_threads):
+            out[start:start + Y_p.shape[0]] = Y_p
+            start += Y_p.shape[0]
+        if start != out.shape[0]:
+            raise ValueError(f"out has {out.shape[0]} rows, but L has {start}.")
+        return out
+
+    def predict_task_proba(self, L, t=0, **kwargs):
+        """Returns the n x K_t matrix of marginal label probabilities 
+        P(Y_t | \lambda) of task t of a multi-task model, i.e. the sum of the
+        probabilities of the feasible label vectors y with y_t = 1,...,K_t.
+        
+        Note that the rows sum to the probability that task t is applicable
+        (i.e. y_t != -1) rather than to one.
+        """
+        return self._marginalize(self.predict_proba(L, **kwargs), t=t)
+
+    def _get_task_aggregation_matrix(self):
+        """Returns a tuple (A, offsets), where A is the k x sum_t K_t sparse 
+        matrix mapping the probabilities of the feasible label vectors to the
+        per-task marginals, i.e. with A[yi, offsets[t] + y_t - 1] = 1 for the 
+        yi-th feasible label vector y, for each task t where y_t != -1.
+        
+        It is computed once from the task graph, and then cached.
+        """
+        if not self.multi_task:
+            raise ValueError("Marginals require a multi-task LabelModel.")
+        if not hasattr(self, '_task_aggregation_matrix'):
+            Y = self.task_graph.feasible_array
+            offsets = np.concatenate([[0], np.cumsum(self.task_graph.K_t)])
+            rows, tasks = np.nonzero(Y > 0)
+            cols = offsets[tasks] + Y[rows, tasks] - 1
+            A = csr_matrix((np.ones(len(rows)), (rows, cols)), 
+                shape=(Y.shape[0], offsets[-1]))
+            self._task_aggregation_matrix = (A, offsets)
+        return self._task_aggregation_matrix
+
+    def _marginalize(self, Y_p, t=None):
+        """Maps the n x k probabilities Y_p of the feasible label vectors to
+        the per-task marginals (of all tasks, or only of task t) via a single
+        sparse matmul"""
+        A, offsets = self._get_task_aggregation_matrix()
+        if t is not None:
+            A = A[:, offsets[t]:offsets[t+1]]
+        return np.asarray((A.T @ Y_p.T).T)
 
     def get_label_probs(self, L):
         """Returns the n x k matrix of label probabilities P(Y | \lambda)"""
-        L_aug = self._get_augmented_label_matrix(L, offset=1)        
-        mu = np.clip(self.mu.detach().clone().numpy(), 0.01, 0.99)
-
-        # Create a "junction tree mask" over the columns of L_aug / mu
-        if len(self.deps) > 0:
-            jtm = np.zeros(L_aug.shape[1])
-
-            # All maximal cliques are +1
-            for i in self.c_tree.nodes():
-                node = self.c_tree.node[i]
-                jtm[node['start_index']:node['end_index']] = 1
-
-            # All separator sets are -1
-            for i, j in self.c_tree.edges():
-                edge = self.c_tree[i][j]
-                jtm[edge['start_index']:edge['end_index']] = 1
+        if self._get_prediction_cache() is not None:
+            return self._get_cached_label_probs(L)
+
+        # Compute the probabilities once per unique row, then scatter back
+        if self.config['deduplicate_rows']:
+            L, inverse, _ = self._deduplicate_rows(L)
+            return self._get_label_probs(L)[inverse]
+        else:
+            return self._get_label_probs(L)
+
+    def _get_prediction_cache(self):
+        """Returns the PredictionCache of the current mu (or None if disabled
+        by config['prediction_cache_size']); a new, empty cache is swapped in
+        whenever mu or the configured size changes"""
+        max_size = self.config.get('prediction_cache_size', 0)
+        if not max_size:
+            return None
+        state = getattr(self, '_prediction_cache', None)
+        if state is None or state[0] is not self.mu or \
+            state[1].max_size != max_size:
+            state = (self.mu, PredictionCache(max_size))
+            self._prediction_cache = state
+        return state[1]
+
+    def prediction_cache_info(self):
+        """Returns a dict of the hits, misses, size and max_size of the 
+        prediction cache (or None if it is disabled)"""
+        cache = self._get_prediction_cache()
+        return cache.info() if cache is not None else None
+
+    def _get_cached_label_probs(self, L):
+        """Returns the label probabilities of L, looking up each unique row
+        vote pattern in the prediction cache, and running inference only on
+        the patterns which are not cached"""
+        cache = self._get_prediction_cache()
+        if self.multi_task:
+            n = L[0].shape[0]
+        else:
+            n = L.shape[0]
+        if n > 1 and self.config['deduplicate_rows']:
+            L, inverse, _ = self._deduplicate_rows(L)
+        else:
+            inverse = None
+
+        # Key the rows by their votes (on all tasks, if multi-task)
+        if self.multi_task:
+            keys = get_row_keys(hstack([csr_matrix(L_s) for L_s in L]))
+        else:
+            keys = get_row_keys(L)
+        values, missing = cache.lookup(keys)
+        if len(missing) > 0:
+            if self.multi_task:
+                L_missing = [csr_matrix(L_s)[missing] for L_s in L]
+            else:
+                L_missing = csr_matrix(L)[missing]
+            Y_missing = self._get_label_probs(L_missing)
+            for i, Y_i in zip(missing, Y_missing):
+                values[i] = Y_i
+
+            # Cache copies of the rows, so that the entries do not keep all of
+            # Y_missing alive; only the last max_size rows can be retained
+            start = max(len(missing) - cache.max_size, 0)
+            rows = [Y_i.copy() for Y_i in Y_missing[start:]]
+            for Y_i in rows:
+                Y_i.flags.writeable = False
+            cache.update([keys[i] for i in missing[start:]], rows)
+        Y_p = np.vstack(values) if values else np.zeros((0, self.k))
+        return Y_p[inverse] if inverse is not None else Y_p
+
+    def _get_log_prob_tables(self):
+        """Returns the lookup tables used for inference:
+            - log_mu: A d x k array, where row i*k + ly is the log conditional 
+                probability of source i emitting (non-abstain) label 
+                ly + 1, i.e. log P(\lambda_i = ly + 1 | Y = y) in column y
+            - log_p: The k-dim log class balance
+
+        The tables are read-only arrays, computed once per value of mu (i.e.
+        after each call to train, or if mu is replaced) and swapped in with a
+        single assignment, so concurrent inference calls never see them 
+        partially updated.
+        """
+        state = getattr(self, '_inference_state', None)
+        if state is None or state[0] is not self.mu:
+            self._set_inference_state()
+            state = self._inference_state
+        return state[1], state[2]
+
+    def _set_inference_state(self):
+        """Captures the (immutable) state used for inference from mu and p"""
+        log_mu = np.log(np.clip(self.mu.detach().clone().numpy(), 0.01, 0.99))
+        log_p = np.log(self.p)
+        for X in [log_mu, log_p]:
+            X.flags.writeable = False
+        self._inference_state = (self.mu, log_mu, log_p)
+
+    def _get_label_probs(self, L):
+        """Computes P(Y | \lambda) by summing the log conditional probability
+        table entries of the non-abstain votes in each row, in O(nnz * k).
+
+        Note: We omit abstains, effectively assuming uniform distribution here;
+        rows where every source abstains thus get the class balance p.
+        """
+        log_mu, log_p = self._get_log_prob_tables()
+        if self.multi_task:
+            # A vote can match several feasible label vectors, so here we use
+            # the sparse indicator matrix rather than a single lookup per vote
+            scores = self._get_augmented_label_matrix(L, offset=1) @ log_mu
         else:
-            jtm = np.ones(L_aug.shape[1])
+            scores = get_unary_scores(L, log_mu, self.k)
+        return normalize_scores(scores, log_p)
 
-        # Note: We omit abstains, effectively assuming uniform distribution here
-        X = np.exp( L_aug @ np.diag(jtm) @ np.log(mu) + np.log(self.p) )
-        Z = np.tile(X.sum(axis=1).reshape(-1,1), self.k)
-        return X / Z
+    def export_predictor(self):
+        """Returns a LabelModelPredictor, a pure-NumPy object holding only the
+        inference tables of the trained model, which can be used (or saved, 
+        and loaded) to serve predictions without importing torch"""
+        log_mu, log_p = self._get_log_prob_tables()
+        feasible_set = self._get_feasible_set() if self.multi_task else None
+        return LabelModelPredictor(log_mu, log_p, feasible_set=feasible_set)
+
+    # Note: The losses below support params (and O) with leading batch
+    # dimensions, e.g. for multiple restarts, and return one loss per entry
 
     def loss_inv_Z(self, l2=0.0):
-        return torch.norm((self.O_inv + self.Z @ self.Z.t())[self.mask])**2
+        ZZt = self.Z @ self.Z.transpose(-2, -1)
+        return torch.sum((self.O_inv + ZZt)[..., self.mask]**2, -1)
+
+    def loss_inv_Z_low_rank(self, l2=0.0):
+        """Equivalent to loss_inv_Z, but never forms a d x d matrix: the full 
+        squared norm is expanded via trace identities over the rank-k factor Z,
+        and the entries of the masked-out blocks are then subtracted."""
+        I, J = self.mask_idx
+        Z = self.Z
+        norm_full = (self._get_sq_norm('O_inv')
+            + 2 * torch.sum((self.O_inv @ Z) * Z, (-2, -1))
+            + torch.sum((Z.transpose(-2, -1) @ Z)**2, (-2, -1)))
+        norm_masked_out = torch.sum((self.O_inv[..., I, J] 
+            + torch.sum(Z[..., I, :] * Z[..., J, :], -1))**2, -1)
+        return norm_full - norm_masked_out
     
+    def _get_sq_norm(self, name):
+        """Returns the squared Frobenius norm of the constant matrix O or O_inv
+        (per leading batch entry), computed once per value of the matrix 
+        rather than on every loss evaluation"""
+        X = getattr(self, name)
+        sq_norms = getattr(self, '_sq_norms', {})
+        if name not in sq_norms or sq_norms[name][0] is not X:
+            sq_norms = dict(sq_norms)
+            sq_norms[name] = (X, torch.sum(X**2, (-2, -1)))
+            self._sq_norms = sq_norms
+        return sq_norms[name][1]
+
+    def _get_Q_factors(self):
+        """Returns U, W such that Q = U W U^T, with U = O Z (d x k), using the
+        eigendecomposition of O cached by _generate_O_inv"""
+        Z = self.Z.detach().double().numpy()
+        w, V = self._O_eig
+        Y = np.swapaxes(V, -2, -1) @ Z
+        wY = w[..., None] * Y
+        I_k = np.eye(self.k)
+        U = V @ wY
+        W = np.linalg.inv(I_k + np.swapaxes(Y, -2, -1) @ wY)
+        return U, W
+
     def get_Q(self):
         """Get the model's estimate of Q = \mu P \mu^T
         
         We can then separately extract \mu subject to additional constraints,
         e.g. \mu P 1 = diag(O).
         """
-        Z = self.Z.detach().clone().numpy()
-        O = self.O.numpy()
-        I_k = np.eye(self.k)
-        return O @ Z @ np.linalg.inv(I_k + Z.T @ O @ Z) @ Z.T @ O
+        U, W = self._get_Q_factors()
+        return U @ W @ np.swapaxes(U, -2, -1)
+
+    def _loss_diag_O(self, muP):
+        """The constraint that np.sum( mu P, 1 ) = diag(O)"""
+        diag_O = torch.diagonal(self.O, dim1=-2, dim2=-1)
+        return torch.sum((torch.sum(muP, -1) - diag_O)**2, -1)
 
     def loss_inv_mu(self, l2=0.0):
-        loss_1 = torch.norm(self.Q - self.mu @ self.P @ self.mu.t())**2
-        loss_2 = torch.norm(
-            torch.sum(self.mu @ self.P, 1) - torch.diag(self.O))**2
+        muP = self.mu @ self.P
+        loss_1 = torch.sum((self.Q - muP @ self.mu.transpose(-2, -1))**2, 
+            (-2, -1))
+        loss_2 = self._loss_diag_O(muP)
+        return loss_1 + loss_2
+
+    def loss_inv_mu_low_rank(self, l2=0.0):
+        """Equivalent to loss_inv_mu, but never forms a d x d matrix, using the
+        rank-k factors Q = U W U^T and trace identities"""
+        muP = self.mu @ self.P
+        Ut = self.Q_U.transpose(-2, -1)
+        WG = self.Q_W @ (Ut @ self.Q_U)
+        B = Ut @ self.mu
+        A = self.mu.transpose(-2, -1) @ muP
+        loss_1 = (torch.sum(WG * WG.transpose(-2, -1), (-2, -1)) 
+            - 2 * torch.sum((self.Q_W @ B) * (B @ self.P), (-2, -1))
+            + torch.sum(A * A.transpose(-2, -1), (-2, -1)))
+        loss_2 = self._loss_diag_O(muP)
         return loss_1 + loss_2
     
     def loss_mu(self, l2=0.0):
-        loss_1 = torch.norm(
-            (self.O - self.mu @ self.P @ self.mu.t())[self.mask])**2
-        loss_2 = torch.norm(
-            torch.sum(self.mu @ self.P, 1) - torch.diag(self.O))**2
+        muP = self.mu @ self.P
+        loss_1 = torch.sum(
+            (self.O - muP @ self.mu.transpose(-2, -1))[..., self.mask]**2, -1)
+        loss_2 = self._loss_diag_O(muP)
         # loss_l2 = torch.norm( self.mu - self.mu_init )**2
         loss_l2 = 0
         return loss_1 + loss_2 + l2 * loss_l2
+
+    def loss_mu_low_rank(self, l2=0.0):
+        """Equivalent to loss_mu, but never forms a d x d matrix: the full
+        squared norm ||O - mu P mu^T||^2 is expanded via trace identities over
+        the rank-k factors, and the entries of the masked-out blocks are then
+        subtracted, for O(d^2 k) time (from O @ mu) and O(d k) memory."""
+        I, J = self.mask_idx
+        muP = self.mu @ self.P
+        A = self.mu.transpose(-2, -1) @ muP
+        norm_full = (self._get_sq_norm('O')
+            - 2 * torch.sum((self.O @ self.mu) * muP, (-2, -1))
+            + torch.sum(A * A.transpose(-2, -1), (-2, -1)))
+        norm_masked_out = torch.sum((self.O[..., I, J] 
+            - torch.sum(muP[..., I, :] * self.mu[..., J, :], -1))**2, -1)
+        loss_1 = norm_full - norm_masked_out
+        loss_2 = self._loss_diag_O(muP)
+        return loss_1 + loss_2
     
-    def train(self, L, **kwargs):
+    def train(self, L=None, warm_start=False, **kwargs):
         """Train the model (i.e. estimate mu) in one of two ways, depending on
         whether source dependencies are provided or not:
         
@@ -323,67 +1018,412 @@ class LabelModel(Classifier):
                 (2a) O_\Omega + (ZZ.T)_\Omega = 0, \Omega is the deps mask
             - Then, compute Q = mu P mu.T
             - Finally, estimate mu subject to mu P mu.T = Q and (1b)
+
+        Note that L may also be an iterable over row chunks of the label
+        matrix, in which case O is accumulated out-of-core, one chunk at a time.
+        Setting n_jobs > 1 computes O over row shards in a process pool.
+
+        The number of epochs and wall time used for each estimated parameter
+        are stored in self.train_stats.
+
+        Setting low_rank_loss=True uses loss implementations which never form
+        d x d matrices, for models with thousands of sources.
+
+        If n_restarts > 1, that many independently initialized params are
+        trained jointly as a batch, and the one with the lowest loss is kept.
+
+        If L is None, the model is re-fit to its current overlap statistics 
+        (e.g. after add_rows or add_sources); if warm_start is True, the
+        params are initialized from their values from the previous fit.
         """
         self.config = recursive_merge_dicts(self.config, kwargs, 
             misses='ignore')
+        n_jobs = self.config['train_config']['n_jobs']
+        low_rank = self.config['train_config']['low_rank_loss']
+        if L is None and not hasattr(self, 'overlaps'):
+            raise ValueError("L must be provided when first training a model.")
+        prev_params = {name: param.detach().clone() 
+            for name, param in self.named_parameters()} if warm_start else {}
+
+        # Compute O (unless re-fitting to the current overlap statistics)
+        if L is not None:
+            if self.config['verbose']:
+                print("Computing O...")
+            self._generate_O(L, n_jobs=n_jobs)
 
         if self.inv_form:
-            # Compute O, O^{-1}, and initialize params
+            # Compute O^{-1}, and initialize params
             if self.config['verbose']:
                 print("Computing O^{-1}...")
-            self._generate_O_inv(L)
+            self._generate_O_inv()
             self._init_params()
+            self._warm_start(prev_params)
 
             # Estimate Z, compute Q = \mu P \mu^T
             if self.config['verbose']:
                 print("Estimating Z...")
-            self._train(self.loss_inv_Z)
-            self.Q = torch.from_numpy(self.get_Q()).float()
+            if low_rank:
+                self.train_stats = {'Z': self._train(self.loss_inv_Z_low_rank)}
+                U, W = self._get_Q_factors()
+                self.Q_U = torch.from_numpy(U).float()
+                self.Q_W = torch.from_numpy(W).float()
+            else:
+                self.train_stats = {'Z': self._train(self.loss_inv_Z)}
+                self.Q = torch.from_numpy(self.get_Q()).float()
+            self.train_stats['O_inv'] = self.O_inv_stats
 
             # Estimate \mu
             if self.config['verbose']:
                 print("Estimating \mu...")
-            self._train(self.loss_inv_mu)
+            loss_fn = self.loss_inv_mu_low_rank if low_rank else self.loss_inv_mu
+            self.train_stats['mu'] = self._train(loss_fn)
         else:
-            # Compute O and initialize params
-            if self.config['verbose']:
-                print("Computing O...")
-            self._generate_O(L)
+            # Initialize params
             self._init_params()
+            self._warm_start(prev_params)
 
             # Estimate \mu
             if self.config['verbose']:
                 print("Estimating \mu...")
-            self._train(self.loss_mu)
+            loss_fn = self.loss_mu_low_rank if low_rank else self.loss_mu
+            self.train_stats = {'mu': self._train(loss_fn)}
+
+        if self.config['train_config']['n_restarts'] > 1:
+            self._select_restart(loss_fn)
+        self._set_inference_state()
+
+    def _select_restart(self, loss_fn):
+        """Keeps the restart (i.e. entry along the leading dimension of the 
+        params) with the lowest final loss"""
+        with torch.no_grad():
+            losses = loss_fn(l2=self.config['train_config']['l2'])
+        best = int(torch.argmin(losses))
+        for name, _ in list(self.named_parameters()):
+            setattr(self, name, 
+                nn.Parameter(getattr(self, name).detach()[best].clone()))
+        for name in ['Q', 'Q_U', 'Q_W']:
+            if hasattr(self, name) and getattr(self, name).dim() == 3:
+                setattr(self, name, getattr(self, name)[best])
+        self.train_stats['restart_losses'] = losses.tolist()
+        if self.config['verbose']:
+            print(f"Selected restart {best} with final loss "
+                f"{losses[best].item():0.6f}")
+
+    def _set_optimizer(self, optimizer_config):
+        opt = optimizer_config['optimizer']
+        if opt == 'sgd':
+            optimizer = optim.SGD(
+                self.parameters(),
+                **optimizer_config['optimizer_common'],
+                **optimizer_config['sgd_config']
+            )
+        elif opt == 'adam':
+            adam_config = optimizer_config['adam_config']
+            optimizer = optim.Adam(
+                self.parameters(),
+                **optimizer_config['optimizer_common'],
+                betas=(adam_config['beta1'], adam_config['beta2'])
+            )
+        elif opt == 'lbfgs':
+            optimizer = optim.LBFGS(
+                self.parameters(),
+                **optimizer_config['optimizer_common'],
+                **optimizer_config['lbfgs_config']
+            )
+        else:
+            raise ValueError(f"Did not recognize optimizer option '{opt}'") 
+        return optimizer
 
     def _train(self, loss_fn):
-        """Train model (self.parameters()) by optimizing the provided loss fn"""
+        """Train model (self.parameters()) by optimizing the provided loss fn
+
+        Training runs for at most n_epochs, stopping early if the relative
+        change in the loss falls below loss_tol or the norm of the gradient 
+        falls below grad_tol (if set).
+
+        Returns:
+            A dict with the number of epochs run, the number of optimizer
+            iterations and loss evaluations (which exceed the epochs for 
+            L-BFGS, which runs up to max_iter iterations per epoch), the final
+            loss and gradient norm, whether training converged early, and the
+            wall time used
+        """
         train_config = self.config['train_config']
+        loss_tol, grad_tol = train_config['loss_tol'], train_config['grad_tol']
+        start_time = time.time()
 
-        # Set optimizer as SGD w/ momentum
-        optimizer_config = self.config['train_config']['optimizer_config']
-        optimizer = optim.SGD(
-            self.parameters(),
-            **optimizer_config['optimizer_common'],
-            **optimizer_config['sgd_config']
-        )
+        # Set optimizer (SGD w/ momentum by default)
+        optimizer = self._set_optimizer(train_config['optimizer_config'])
+
+        n_evals = 0
+        def closure():
+            nonlocal n_evals
+            n_evals += 1
+            optimizer.zero_grad()
+            loss = loss_fn(l2=train_config['l2']).sum()
+            if torch.isnan(loss):
+                raise Exception("Loss is NaN. Consider reducing learning rate.")
+            loss.backward()
+            return loss
 
         # Train model
+        epoch, loss, grad_norm = -1, float('nan'), float('nan')
+        prev_loss = None
+        converged = False
         for epoch in range(train_config['n_epochs']):
-            optimizer.zero_grad()
-            
             # Compute gradient and take a step
             # Note that since this uses all N training points this is an epoch!
-            loss = loss_fn(l2=train_config['l2'])
-            if torch.isnan(loss):
-                raise Exception("Loss is NaN. Consider reducing learning rate.")
+            loss = optimizer.step(closure).item()
+            grad_norm = torch.norm(torch.cat([param.grad.view(-1) 
+                for param in self.parameters() if param.grad is not None]))
+            grad_norm = grad_norm.item()
 
-            loss.backward()
-            optimizer.step()
-            
             # Print loss every print_every steps
             if (self.config['verbose'] and 
                 (epoch % train_config['print_every'] == 0 
                 or epoch == train_config['n_epochs'] - 1)):
-                msg = f"[Epoch {epoch}] Loss: {loss.item():0.6f}"
-                print(msg)
\ No newline at end of file
+                msg = f"[Epoch {epoch}] Loss: {loss:0.6f}"
+                print(msg)
+            
+            # Check for convergence
+            if grad_tol is not None and grad_norm < grad_tol:
+                converged = True
+            if loss_tol is not None and prev_loss is not None:
+                rel_change = abs(prev_loss - loss) / max(abs(prev_loss), 1e-12)
+                converged = converged or rel_change < loss_tol
+            prev_loss = loss
+            if converged:
+                break
+        
+        # L-BFGS tracks its own (inner) iterations
+        if isinstance(optimizer, optim.LBFGS):
+            param = optimizer.param_groups[0]['params'][0]
+            n_iter = optimizer.state[param].get('n_iter', 0)
+        else:
+            n_iter = epoch + 1
+
+        stats = {
+            'n_epochs': epoch + 1,
+            'n_iter': n_iter,
+            'n_evals': n_evals,
+            'loss': loss,
+            'grad_norm': grad_norm,
+            'converged': converged,
+            'time': time.time() - start_time,
+        }
+        if self.config['verbose']:
+            status = "Converged" if converged else "Finished"
+            print(f"{status} after {stats['n_epochs']} epochs "
+                f"({n_iter} iterations, {stats['time']:0.2f}s). "
+                f"Final loss: {loss:0.6f}")
+        return stats
+
+    def save(self, path, log_tables=True):
+        """Saves the trained model to path as a compact .npz artifact
+
+        The artifact contains the arrays:
+            - m, k: The number of sources and classes
+            - p: The k-dim class balance
+            - mu: The d x k estimated conditional probabilities
+            - deps: The source dependencies, as an n_deps x 2 array
+            - clique_members, clique_sizes, clique_edges: The clique tree, as
+                the concatenated members of its maximal cliques, the number of
+                members of each, and its (clique index) edges
+            - task_edges, task_cardinalities, feasible_set: The TaskHierarchy,
+                and its feasible set (if multi-task)
+            - config: The model config, as a JSON string
+            - log_mu, log_p: The inference tables (if log_tables is True; see
+                _get_log_prob_tables), so they need not be recomputed on load
+
+        Args:
+            - path: The file path (or file-like object) to write to
+            - log_tables: Whether to store the precomputed inference tables
+        """
+        if self.mu.dim() != 2:
+            raise ValueError("Only a single (unbatched) model can be saved.")
+        cliques = [sorted(self.c_tree.node[i]['members']) 
+            for i in self.c_tree.nodes()]
+        arrays = {
+            'm': np.array(self.m),
+            'k': np.array(self.k),
+            'p': np.asarray(self.p),
+            'mu': self.mu.detach().numpy(),
+            'deps': np.array(self.deps, dtype=np.int64).reshape(-1, 2),
+            'clique_members': np.array(list(chain(*cliques)), dtype=np.int64),
+            'clique_sizes': np.array([len(c) for c in cliques], dtype=np.int64),
+            'clique_edges': np.array(list(self.c_tree.edges()), 
+                dtype=np.int64).reshape(-1, 2),
+            'config': np.array(json.dumps(self.config, 
+                default=lambda x: np.asarray(x).tolist())),
+        }
+        if self.multi_task:
+            arrays['task_edges'] = np.array(self.task_graph.edges, 
+                dtype=np.int64).reshape(-1, 2)
+            arrays['task_cardinalities'] = np.array(self.task_graph.K_t)
+            arrays['feasible_set'] = self._get_feasible_set()
+        if log_tables:
+            arrays['log_mu'], arrays['log_p'] = self._get_log_prob_tables()
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a model saved with save, for inference or re-training
+
+        The clique tree is restored directly from the stored cliques and edges
+        (rather than by re-triangulating the dependency graph), and __init__ is
+        bypassed, so loading does not reseed the global random state.
+        """
+        with np.load(path) as f:
+            arrays = dict(f)
+        model = cls.__new__(cls)
+        nn.Module.__init__(model)
+        model.config = json.loads(str(arrays['config']))
+        model.seed = model.config['seed']
+        model.multitask = False
+        model.m = int(arrays['m'])
+        model.k = int(arrays['k'])
+        model.p = arrays['p']
+        model.P = torch.diag(torch.from_numpy(model.p)).float()
+        model.deps = [tuple(e) for e in arrays['deps'].tolist()]
+        model.inv_form = (len(model.deps) > 0)
+
+        # Task graph
+        if 'task_edges' in arrays:
+            from metal.multitask.task_graph import TaskHierarchy
+            model.task_graph = TaskHierarchy(
+                edges=[tuple(e) for e in arrays['task_edges'].tolist()],
+                cardinalities=arrays['task_cardinalities'].tolist())
+        else:
+            model.task_graph = None
+        model.multi_task = (model.task_graph is not None)
+
+        # Clique tree
+        ends = np.cumsum(arrays['clique_sizes'])
+        members = np.split(arrays['clique_members'], ends[:-1])
+        c_tree = nx.Graph()
+        for i, c in enumerate(members):
+            c_tree.add_node(i, members=set(c.tolist()))
+        for i, j in arrays['clique_edges'].tolist():
+            S = c_tree.nodes[i]['members'] & c_tree.nodes[j]['members']
+            c_tree.add_edge(i, j, weight=len(S), members=S)
+        model.c_tree = c_tree
+
+        # Params, and (if stored) inference tables
+        model.mu = nn.Parameter(torch.from_numpy(arrays['mu']))
+        model.d = model.mu.shape[0]
+        if 'log_mu' in arrays:
+            for X in [arrays['log_mu'], arrays['log_p']]:
+                X.flags.writeable = False
+            model._inference_state = (model.mu, arrays['log_mu'], 
+                arrays['log_p'])
+        return model
+
+class OverlapStatistics(object):
+    """The sufficient statistics for fitting a LabelModel: the unnormalized 
+    overlaps matrix counts = L_aug^T L_aug (so that O = counts / n) and the
+    number of rows n, which support adding rows or sources incrementally.
+
+    The label matrix itself is not kept; adding sources requires passing it
+    in again (see add_sources).
+    """
+    def __init__(self, model):
+        self.model = model
+        self.counts = None
+        self.n = 0
+
+    def add_rows(self, L_new, n_jobs=1):
+        """Adds the overlap counts of the rows L_new, which may also be an
+        iterable of row chunks (see LabelModel._generate_O)"""
+        model = self.model
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        chunked = model._is_chunked(L_new)
+
+        if n_jobs > 1:
+            pool, results = _map_overlap_counts(model, L_new, n_jobs)
+        else:
+            pool = None
+            chunks = L_new if chunked else [L_new]
+            results = map(model._get_overlap_counts, chunks)
+
+        # Reduce the partial counts
+        try:
+            for counts, n in results:
+                if self.counts is None:
+                    self.counts = counts
+                else:
+                    self.counts = self.counts + counts
+                self.n += n
+        finally:
+            if pool is not None:
+                pool.terminate()
+        if self.counts is None:
+            raise ValueError("L must contain at least one chunk of rows.")
+
+    def add_sources(self, L_cols, L):
+        """Adds the overlap counts of the new sources L_cols, for the rows of
+        the current label matrix L, computing only the new blocks; note that
+        the model's sources (and c_tree) should already include them."""
+        model = self.model
+        if model.multi_task:
+            L = [hstack([csr_matrix(L_s), csr_matrix(L_c)], format='csr') 
+                for L_s, L_c in zip(L, L_cols)]
+        else:
+            L = hstack([csr_matrix(L), csr_matrix(L_cols)], format='csr')
+
+        # Compute the counts of the new columns only, and fill in the blocks
+        d_old = self.counts.shape[0]
+        counts_new, _ = model._get_overlap_counts(L, start_col=d_old)
+        self.counts = np.block([
+            [self.counts, counts_new[:d_old]],
+            [counts_new[:d_old].T, counts_new[d_old:]]
+        ])
+
+
+# Per-process state of the workers used by _map_overlap_counts; with the fork
+# start method this is inherited copy-on-write, so the label matrix is shared
+# with (rather than copied to) the workers
+_worker_state = {}
+
+def _init_overlap_worker(model, L):
+    _worker_state['model'] = model
+    _worker_state['L'] = L
+
+def _overlap_counts_chunk(L_chunk):
+    return _worker_state['model']._get_overlap_counts(L_chunk)
+
+def _overlap_counts_shard(bounds):
+    model, L = _worker_state['model'], _worker_state['L']
+    return model._get_overlap_counts(model._slice_rows(L, *bounds))
+
+def _map_overlap_counts(model, L, n_jobs):
+    """Computes the partial overlap counts of L in a pool of n_jobs processes
+
+    If L is a single label matrix, it is split into n_jobs row shards which are
+    sliced out of the shared L by the workers; if L is an iterable of row
+    chunks, the chunks are sent to the workers as they are read.
+
+    Returns:
+        - pool: The multiprocessing.Pool, to be terminated by the caller
+        - results: An iterator over (counts, n) tuples, in arbitrary order
+    """
+    try:
+        ctx = mp.get_context('fork')
+    except ValueError:
+        ctx = mp.get_context()
+
+    if model._is_chunked(L):
+        pool = ctx.Pool(n_jobs, _init_overlap_worker, (model, None))
+        return pool, pool.imap_unordered(_overlap_counts_chunk, L)
+
+    # Row slicing requires CSR format for sparse matrices
+    if model.multi_task:
+        L = [csr_matrix(L_s) if issparse(L_s) else L_s for L_s in L]
+        n = L[0].shape[0]
+    else:
+        L = csr_matrix(L) if issparse(L) else L
+        n = L.shape[0]
+    splits = np.linspace(0, n, n_jobs + 1).astype(int)
+    bounds = [(s, e) for s, e in zip(splits[:-1], splits[1:]) if e > s]
+    pool = ctx.Pool(n_jobs, _init_overlap_worker, (model, L))
+    return pool, pool.imap_unordered(_overlap_counts_shard, bounds)
@@ -4,6 +4,11 @@ lm_model_defaults = {
     'verbose': True,
     'show_plots': True,
     'cardinality': 2,
+    # Collapse L into its unique rows (with counts) when training / predicting
+    'deduplicate_rows': True,
+    # Max number of row vote patterns whose label probabilities are cached by
+    # predict_proba, with LRU eviction (0 = no cache)
+    'prediction_cache_size': 0,
     
     ### TRAIN
     'train_config': {
@@ -14,10 +19,22 @@ lm_model_defaults = {
         'class_balance_init': None, # (array) If None, assume uniform
         # Model params initialization / priors
         'mu_init': 0.4, 
+        # How to initialize mu: with random diagonal entries, or from closed-
+        # form (method-of-moments) estimates of the LF accuracies from O
+        'mu_init_method': 'random', # ['random', 'moments']
         # L2 regularization (around prior values)
         'l2': 0.01,
+        # Evaluate the masked losses via their rank-k factors, without forming
+        # d x d matrices (faster for large numbers of sources)
+        'low_rank_loss': False,
+        # Inverse form (with deps): ridge added to the eigenvalues of O when
+        # inverting it, and the max condition number of O before raising an
+        # error (None = never raise)
+        'inv_ridge': 0.0,
+        'inv_max_cond': 1e8,
         # Optimizer
         'optimizer_config': {
+            'optimizer': 'sgd', # ['sgd', 'adam', 'lbfgs']
             'optimizer_common': {
                 'lr': 0.01,
             },
@@ -25,9 +42,30 @@ lm_model_defaults = {
             'sgd_config': {
                 'momentum': 0.9, 
             },
+            # Optimizer - Adam
+            'adam_config': {
+                'beta1': 0.9,
+                'beta2': 0.999,
+            },
+            # Optimizer - L-BFGS (max_iter = max iterations per epoch;
+            # line_search_fn='strong_wolfe' requires torch >= 1.2)
+            'lbfgs_config': {
+                'max_iter': 20,
+                'history_size': 10,
+                'line_search_fn': None,
+            },
         },
+        # Number of random initializations of the params to train jointly, 
+        # keeping the one with the lowest final loss
+        'n_restarts': 1,
+        # Number of processes used to compute O (-1 = all cores)
+        'n_jobs': 1,
         # Train loop
         'n_epochs': 100, 
         'print_every': 10, 
+        # Stop early if the relative change in loss or the gradient norm falls
+        # below these tolerances (None = always run n_epochs)
+        'loss_tol': None,
+        'grad_tol': None,
     },
 }
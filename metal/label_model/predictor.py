@@ -0,0 +1,226 @@
+"""A lightweight predictor for trained LabelModels, for serving.
+
+This module only depends on numpy and scipy.sparse (in particular, not on torch
+or on the plotting / analysis stack), so that it can be imported cheaply, e.g.:
+
+    from metal.label_model.predictor import LabelModelPredictor
+    predictor = LabelModelPredictor.load('label_model.npz')
+    Y_p = predictor.predict_proba(L)
+
+The inference kernels below are shared with LabelModel.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+
+def get_unary_scores(L, log_mu, k):
+    """Returns the n x k matrix of the sums of the log conditional probability
+    table entries of the non-abstain votes in each row of L, in O(nnz * k).
+
+    Args:
+        - L: An n x m numpy array or scipy.sparse matrix, with values in
+            {0,1,...,k} (any other values are ignored)
+        - log_mu: A d x k array, where row i*k + ly (for i < m) is the log
+            conditional probability of source i emitting (non-abstain) label
+            ly + 1
+        - k: The number of classes
+    """
+    L = csr_matrix(L, copy=True)
+    L.sum_duplicates()
+
+    # Drop abstains, and any values outside {1,...,k}
+    L.data[(L.data < 1) | (L.data > k)] = 0
+    L.eliminate_zeros()
+    n = L.shape[0]
+
+    # Gather the table rows of the votes, then sum them over each row
+    votes = log_mu[L.indices * k + L.data.astype(np.int64) - 1]
+    scores = np.zeros((n, k))
+    voted = np.diff(L.indptr) > 0
+    if voted.any():
+        scores[voted] = np.add.reduceat(votes, L.indptr[:-1][voted], axis=0)
+    return scores
+
+
+def get_multi_task_indicators(L, feasible_set):
+    """Returns the n x (m * k) sparse indicator matrix of multi-task source
+    labels, where column j * k + yi indicates that source j did not abstain on
+    every task, and that its label on each task is either an abstain or agrees
+    with the yi-th feasible label vector.
+
+    Only the entries where a source voted on some task are visited: their
+    per-task label vectors are collapsed to the unique voting patterns, which
+    are matched against the feasible set once each.
+
+    Args:
+        - L: A list of t n x m label matrices, one per task
+        - feasible_set: The k x t array of feasible label vectors
+    """
+    L = [csr_matrix(L_s) for L_s in L]
+    n, m = L[0].shape
+    Y = np.asarray(feasible_set)
+    k = Y.shape[0]
+
+    # The (row, source) entries with at least one non-abstain vote
+    L_any = coo_matrix(sum(abs(L_s) for L_s in L))
+    L_any.eliminate_zeros()
+    rows, cols = L_any.row, L_any.col
+    V = np.column_stack([np.asarray(L_s[rows, cols]).ravel()
+        for L_s in L]).astype(np.int64)
+
+    # Match each unique voting pattern against each feasible label vector
+    V_unique, inverse = np.unique(V, axis=0, return_inverse=True)
+    V_unique = V_unique[:, None, :]
+    match = np.all((V_unique == 0) | (V_unique == Y[None, :, :]), axis=-1)
+    idx, yi = np.nonzero(match[inverse.ravel()])
+    return csr_matrix(
+        (np.ones(len(idx), dtype=np.int64), (rows[idx], cols[idx] * k + yi)),
+        shape=(n, m * k)
+    )
+
+
+def normalize_scores(scores, log_p):
+    """Returns the label probabilities from the n x k log-likelihood scores
+    and the k-dim log class balance, with the log-sum-exp trick"""
+    scores = scores + log_p
+    scores -= scores.max(axis=1).reshape(-1, 1)
+    X = np.exp(scores)
+    return X / X.sum(axis=1).reshape(-1, 1)
+
+
+def get_row_keys(L):
+    """Returns a list of n hashable keys of the rows of L, where two rows have
+    equal keys iff they have the same (non-abstain) votes
+
+    Args:
+        - L: An n x m numpy array or scipy.sparse matrix
+    """
+    L = csr_matrix(L, copy=True)
+    L.sum_duplicates()
+    L.eliminate_zeros()
+    indices = L.indices.astype(np.int64)
+    data = L.data.astype(np.int64)
+    return [(indices[a:b].tobytes(), data[a:b].tobytes()) 
+        for a, b in zip(L.indptr[:-1], L.indptr[1:])]
+
+
+class PredictionCache(object):
+    """A thread-safe, bounded cache of label probability vectors keyed on row
+    vote patterns (see get_row_keys), with least-recently-used eviction.
+
+    Args:
+        - max_size: The maximum number of cached vote patterns
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, keys):
+        """Returns a tuple (values, missing), where values is the list of the
+        cached values of keys (None where missing), and missing is the array of
+        the indices of the missing keys"""
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                values.append(value)
+            missing = np.array([i for i, value in enumerate(values) 
+                if value is None], dtype=np.int64)
+            self.misses += len(missing)
+            self.hits += len(values) - len(missing)
+        return values, missing
+
+    def update(self, keys, values):
+        """Inserts the (key, value) pairs, evicting the least recently used
+        entries if the cache is full"""
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries and resets the hit / miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Returns a dict of the hits, misses, size and max_size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 
+                'size': len(self._entries), 'max_size': self.max_size}
+
+
+class LabelModelPredictor(object):
+    """A pure-NumPy predictor of the label probabilities P(Y | \lambda) of a
+    trained LabelModel (see LabelModel.export_predictor), which holds only its
+    inference tables.
+
+    Args:
+        - log_mu: A d x k array, whose first m * k rows are the log conditional
+            probabilities of the (non-abstain) source labels (see
+            LabelModel._get_log_prob_tables)
+        - log_p: The k-dim log class balance
+        - feasible_set: For a multi-task model, the k x t array of feasible
+            label vectors (None if single-task)
+    """
+    def __init__(self, log_mu, log_p, feasible_set=None):
+        self.log_mu = np.array(log_mu)
+        self.log_p = np.array(log_p)
+        self.k = self.log_p.shape[0]
+        self.feasible_set = feasible_set
+        self.multi_task = (feasible_set is not None)
+        for X in [self.log_mu, self.log_p]:
+            X.flags.writeable = False
+
+    def predict_proba(self, L):
+        """Returns the n x k matrix of label probabilities P(Y | \lambda)
+
+        Args:
+            - L: An n x m label matrix (or a list of t of these, if multi-task)
+        """
+        if self.multi_task:
+            L_aug = get_multi_task_indicators(L, self.feasible_set)
+            scores = L_aug @ self.log_mu[:L_aug.shape[1]]
+        else:
+            scores = get_unary_scores(L, self.log_mu, self.k)
+        return normalize_scores(scores, self.log_p)
+
+    def predict(self, L):
+        """Returns the n-dim array of the most probable labels in {1,...,k}
+        (with ties broken by the lowest label)"""
+        return self.predict_proba(L).argmax(axis=1) + 1
+
+    def save(self, path):
+        """Saves the predictor to path as an .npz artifact"""
+        arrays = {'log_mu': self.log_mu, 'log_p': self.log_p}
+        if self.multi_task:
+            arrays['feasible_set'] = self.feasible_set
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a predictor from an .npz artifact written by either
+        LabelModelPredictor.save or LabelModel.save"""
+        with np.load(path) as f:
+            arrays = dict(f)
+        if 'log_mu' in arrays:
+            log_mu, log_p = arrays['log_mu'], arrays['log_p']
+        else:
+            log_mu = np.log(np.clip(arrays['mu'], 0.01, 0.99))
+            log_p = np.log(arrays['p'])
+        return cls(log_mu, log_p, feasible_set=arrays.get('feasible_set'))
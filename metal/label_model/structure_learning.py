@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.sparse.linalg import eigsh
+
+
+def get_dependency_scores(O, m, k, rank=None, lam=0.05, n_iter=20,
+    ridge=1e-4):
+    """Returns an m x m symmetric array of scores of the dependency between
+    each pair of sources, estimated from the overlaps matrix O alone (so that
+    L need not be re-scanned).
+
+    The covariance of the unary indicators of L_aug follows from O, since
+    E[x] = E[x^2] = diag(O) for indicators. If the sources are conditionally
+    independent given the (latent) label Y, the inverse of their correlation
+    matrix K is the sum of a block-diagonal matrix and a negative semidefinite
+    matrix of rank k - 1, due to Y; dependencies between sources add sparse
+    off-diagonal blocks to the former. We thus decompose K = S - L_r into a
+    sparse S and a rank-r PSD L_r by alternating projections, and score each
+    pair of sources by the norm of its block of the partial correlations S.
+
+    Args:
+        - O: The d x d overlaps matrix (e.g. LabelModel.O), whose first m * k
+            columns are the unary indicators of the (non-abstain) source labels
+        - m, k: The number of sources and classes
+        - rank: The rank of the latent component (default: k - 1)
+        - lam: The soft threshold applied to the off-diagonal blocks of S
+        - n_iter: The number of alternating projection steps
+        - ridge: Added to the diagonal of the correlation matrix before
+            inverting it
+
+    Each step costs O((mk)^2), computing only the top rank eigenpairs of an
+    mk x mk matrix, so this takes seconds for m = 1000.
+    """
+    d = m * k
+    rank = k - 1 if rank is None else rank
+    O = np.asarray(O, dtype=np.float64)[:d, :d]
+
+    # The inverse correlation matrix of the unary indicators
+    mean = np.diag(O)
+    Sigma = O - np.outer(mean, mean)
+    std = np.sqrt(np.clip(np.diag(Sigma), 1e-12, None))
+    C = Sigma / np.outer(std, std)
+    K = np.linalg.inv(C + ridge * np.eye(d))
+
+    # Decompose K = S - L_r, leaving the blocks of each source unthresholded
+    source = np.arange(d) // k
+    same = (source[:, None] == source[None, :])
+    S = np.where(same, K, 0)
+    for _ in range(n_iter):
+        w, V = eigsh(S - K, k=rank, which='LA')
+        L_r = (V * np.clip(w, 0, None)) @ V.T
+        X = K + L_r
+        S = np.where(same, X, np.sign(X) * np.maximum(np.abs(X) - lam, 0))
+
+    # Score the source pairs by their blocks of partial correlations
+    s = np.sqrt(np.abs(np.diag(S)))
+    P = S / np.outer(s, s)
+    scores = np.sqrt((P.reshape(m, k, m, k)**2).sum(axis=(1, 3)))
+    np.fill_diagonal(scores, 0)
+    return scores
+
+
+def learn_deps(O, m, k, thresh=0.1, max_deps=None, **kwargs):
+    """Returns the estimated source dependencies, as a list of (i, j) tuples
+    with i < j in order of decreasing score (see get_dependency_scores), which
+    can be passed as deps to LabelModel (or get_clique_tree)
+
+    Args:
+        - O, m, k: As for get_dependency_scores
+        - thresh: The minimum score of a dependency
+        - max_deps: If not None, at most this many of the top dependencies
+            are returned
+        - kwargs: Passed to get_dependency_scores
+    """
+    scores = get_dependency_scores(O, m, k, **kwargs)
+    I, J = np.triu_indices(m, k=1)
+    keep = scores[I, J] > thresh
+    I, J = I[keep], J[keep]
+    order = np.argsort(-scores[I, J], kind='stable')[:max_deps]
+    return [(int(i), int(j)) for i, j in zip(I[order], J[order])]
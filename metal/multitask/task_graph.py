@@ -63,9 +63,29 @@ class TaskHierarchy(TaskGraph):
         self.leaf_nodes = [i for i in self.G.nodes() if self.G.out_degree(i)==0]
         self.parents = {t: self.get_parent(t) for t in range(self.T)}
         self.children = {t: self.get_children(t) for t in range(self.T)}
+        self._feasible_array = None
+        self._len = len(self.leaf_nodes) * self.k
+
+    @property
+    def feasible_array(self):
+        """The feasible set as a (read-only) len(self) x T integer array, which
+        is computed on first access, along with an index from label vectors to
+        their positions in it"""
+        if self._feasible_array is None:
+            Y = self._get_feasible_array()
+            Y.flags.writeable = False
+            self.feasible_index = {
+                tuple(y): i for i, y in enumerate(Y.tolist())}
+            # Mixed-radix codes of the feasible label vectors (see _encode),
+            # sorted for vectorized lookups
+            codes = self._encode(Y)
+            self._code_order = np.argsort(codes)
+            self._sorted_codes = codes[self._code_order]
+            self._feasible_array = Y
+        return self._feasible_array
 
     def __len__(self):
-        return len(self.leaf_nodes) * self.k
+        return self._len
 
     def __eq__(self, other):
         return self.edges == other.edges and self.K_t == other.K_t
@@ -77,13 +97,49 @@ class TaskHierarchy(TaskGraph):
         return sorted(list(self.G.successors(node)))
 
     def is_feasible(self, y):
-        return (y in list(self.feasible_set()))
-    
+        """Returns whether the T-dim label vector y is feasible, or for an N x T
+        array of label vectors, an N-dim boolean array"""
+        return self.get_feasible_index(y) >= 0
+
+    def get_feasible_index(self, y):
+        """Returns the position of the T-dim label vector y in the feasible set
+        (or -1 if it is infeasible); for an N x T array of label vectors, 
+        returns an N-dim integer array of positions. Label vectors with any 
+        non-integer values are infeasible."""
+        y = np.asarray(y)
+        Y = self.feasible_array
+        integral = np.all(y == np.round(y), axis=-1)
+        if y.ndim == 1:
+            if not integral:
+                return -1
+            return self.feasible_index.get(tuple(y.astype(int).tolist()), -1)
+        codes = self._encode(y)
+        pos = np.searchsorted(self._sorted_codes, codes)
+        pos = np.minimum(pos, Y.shape[0] - 1)
+        found = (self._sorted_codes[pos] == codes) & integral & np.all(
+            (y == -1) | ((y >= 1) & (y <= self.K)), axis=-1)
+        return np.where(found, self._code_order[pos], -1)
+
+    def _encode(self, Y):
+        """Encodes each row of the N x T array Y of label vectors, with values
+        in {-1,1,...,K}, as a single integer in base K + 2"""
+        Y = np.asarray(Y, dtype=np.int64)
+        radix = (self.K + 2) ** np.arange(self.T - 1, -1, -1, dtype=np.int64)
+        return (Y + 1) @ radix
+
     def feasible_set(self):
+        """Iterator over values in feasible set, as new (float) arrays; see
+        feasible_array for the cached integer array"""
+        for y in self.feasible_array:
+            yield y.astype(float)
+
+    def _get_feasible_array(self):
+        """Returns the feasible set as a len(self) x T integer array"""
+        Y = []
         for i in self.leaf_nodes:
             for yi in range(1, self.k+1):
                 # Set all values to default of -1 = not applicable, except leaf
-                y = -1 * np.ones(self.t)
+                y = -1 * np.ones(self.t, dtype=np.int64)
                 y[i] = yi
 
                 # Traverse up the tree
@@ -92,7 +148,8 @@ class TaskHierarchy(TaskGraph):
                     ci = pi
                     pi = list(self.G.predecessors(pi))[0]
                     y[pi] = list(self.G.successors(pi)).index(ci) + 1
-                yield y
+                Y.append(y)
+        return np.array(Y, dtype=np.int64).reshape(-1, self.t)
 
 
 class SingleTaskGraph(TaskHierarchy):
@@ -1,3 +1,5 @@
+import copy
+
 import numpy as np
 from scipy.sparse import issparse, csr_matrix, hstack
 import torch
@@ -175,7 +177,8 @@ def recursive_merge_dicts(x, y, misses='report', verbose=None):
     if verbose is None:
         verbose = y.get('verbose', x.get('verbose', 1))
 
-    z = x.copy()
+    # Deep copy x, so that nested dicts (e.g. model defaults) are not modified
+    z = copy.deepcopy(x)
     recurse(z, y, misses, verbose)
     return z
 
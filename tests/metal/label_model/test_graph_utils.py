@@ -0,0 +1,57 @@
+import unittest
+
+import networkx as nx
+
+from metal.label_model.graph_utils import get_clique_tree, triangulate
+
+
+class GraphUtilsTest(unittest.TestCase):
+
+    def _check_clique_tree(self, nodes, edges, heuristic='min_fill'):
+        c_tree = get_clique_tree(nodes, edges, heuristic=heuristic)
+        self.assertTrue(nx.is_forest(c_tree))
+
+        # Every edge should be covered by some maximal clique
+        cliques = [c_tree.node[i]['members'] for i in c_tree.nodes]
+        for i, j in edges:
+            self.assertTrue(any({i, j} <= c for c in cliques))
+
+        # Running intersection property: the cliques containing each node form
+        # a connected subtree
+        for v in nodes:
+            idxs = [i for i, c in enumerate(cliques) if v in c]
+            self.assertTrue(nx.is_connected(c_tree.subgraph(idxs)))
+        return c_tree
+
+    def test_no_deps(self):
+        c_tree = self._check_clique_tree(range(5), [])
+        self.assertEqual(c_tree.number_of_edges(), 0)
+        for i in range(5):
+            self.assertEqual(c_tree.node[i]['members'], {i})
+
+    def test_chordal(self):
+        edges = [(0,1), (1,2), (2,0), (0,3)]
+        c_tree = self._check_clique_tree(range(5), edges)
+        self.assertEqual(c_tree.node[0]['members'], {0,1,2})
+        self.assertEqual(c_tree.node[1]['members'], {0,3})
+        self.assertEqual(c_tree[0][1]['members'], {0})
+
+    def test_triangulation(self):
+        # A 4-cycle needs one fill edge, and a 6-cycle three
+        for heuristic in ['min_fill', 'min_degree']:
+            for n_cycle in [4, 6]:
+                G = nx.cycle_graph(n_cycle)
+                H, order = triangulate(G, heuristic=heuristic)
+                self.assertTrue(nx.is_chordal(H))
+                self.assertEqual(len(order), n_cycle)
+                self.assertEqual(H.number_of_edges(), 2 * n_cycle - 3)
+                self._check_clique_tree(range(n_cycle), list(G.edges), 
+                    heuristic=heuristic)
+
+    def test_grid(self):
+        G = nx.convert_node_labels_to_integers(nx.grid_2d_graph(6, 6))
+        self._check_clique_tree(range(36), list(G.edges))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import subprocess
 import sys
+import tempfile
 import unittest
 
 import numpy as np
+from scipy.sparse import csr_matrix
 import torch
 
 from metal.label_model.label_model import LabelModel
+from metal.label_model.batched_label_model import BatchedLabelModel
+from metal.label_model.predictor import LabelModelPredictor
 from metal.label_model.baselines import (
     RandomVoter,
     MajorityClassVoter,
@@ -57,6 +65,169 @@ class LabelModelTest(unittest.TestCase):
                 edge_prob=0.0)
             self._test_label_model(data)
 
+    def test_optimizers(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+            edge_prob=0.0)
+        for optimizer in ['adam', 'lbfgs']:
+            label_model = LabelModel(data.m, k=data.k, p=data.p)
+            label_model.train(data.L, n_epochs=1000, optimizer=optimizer,
+                loss_tol=1e-8, grad_tol=1e-6, verbose=False)
+            c_probs_est = label_model.get_conditional_probs()
+            err = np.mean(np.abs(data.c_probs - c_probs_est))
+            self.assertLess(err, 0.015)
+            stats = label_model.train_stats['mu']
+            self.assertTrue(stats['converged'])
+            self.assertGreaterEqual(stats['n_iter'], stats['n_epochs'])
+            self.assertGreaterEqual(stats['n_evals'], stats['n_iter'])
+
+        # Per-call options should not change the defaults of other models
+        train_config = LabelModel(data.m).config['train_config']
+        self.assertEqual(train_config['optimizer_config']['optimizer'], 'sgd')
+        self.assertIsNone(train_config['loss_tol'])
+        self.assertIsNone(train_config['grad_tol'])
+
+    def test_low_rank_loss(self):
+        # The low-rank losses should match the dense losses
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(1000, self.m, k=3, edge_prob=1.0)
+        lm = LabelModel(data.m, k=data.k, p=data.p, deps=data.E)
+        lm.train(data.L, n_epochs=1, verbose=False)
+        lm.Q = torch.from_numpy(lm.get_Q()).float()
+        U, W = lm._get_Q_factors()
+        lm.Q_U, lm.Q_W = torch.from_numpy(U).float(), torch.from_numpy(W).float()
+        for loss, loss_low_rank in [
+            (lm.loss_mu, lm.loss_mu_low_rank),
+            (lm.loss_inv_Z, lm.loss_inv_Z_low_rank),
+            (lm.loss_inv_mu, lm.loss_inv_mu_low_rank)
+        ]:
+            self.assertAlmostEqual(loss().item() / loss_low_rank().item(), 1,
+                places=4)
+
+        # The constant norms of O and O^{-1} are computed once per matrix
+        norm = lm._get_sq_norm('O')
+        self.assertIs(lm._get_sq_norm('O'), norm)
+        self.assertAlmostEqual(norm.item(), torch.sum(lm.O**2).item(), 
+            places=4)
+        lm.O = lm.O.clone()
+        self.assertIsNot(lm._get_sq_norm('O'), norm)
+
+    def test_restarts(self):
+        for edge_prob in [0.0, 1.0]:
+            np.random.seed(1)
+            data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+                edge_prob=edge_prob)
+            label_model = LabelModel(data.m, k=data.k, p=data.p, deps=data.E)
+            label_model.train(data.L, n_epochs=1000, n_restarts=3, 
+                verbose=False)
+            losses = label_model.train_stats['restart_losses']
+            self.assertEqual(len(losses), 3)
+            self.assertEqual(label_model.mu.shape, (data.m * data.k, data.k))
+            self.assertAlmostEqual(label_model.loss_inv_mu().item() 
+                if edge_prob else label_model.loss_mu().item(), min(losses),
+                places=5)
+            c_probs_est = label_model.get_conditional_probs()
+            err = np.mean(np.abs(data.c_probs - c_probs_est))
+            self.assertLess(err, 0.015)
+
+        # Warm-starting only initializes the first restart from the previous
+        # fit, so the others still differ
+        mu = label_model.mu.detach().clone()
+        label_model.update_config({'train_config': {'n_restarts': 3}})
+        label_model._init_params()
+        label_model._warm_start({'mu': mu})
+        self.assertTrue(torch.equal(label_model.mu.detach()[0], mu))
+        self.assertFalse(torch.equal(label_model.mu.detach()[1], mu))
+        self.assertFalse(torch.equal(label_model.mu.detach()[1], 
+            label_model.mu.detach()[2]))
+
+        # Setting n_restarts on one model should not change the defaults
+        self.assertEqual(
+            LabelModel(data.m).config['train_config']['n_restarts'], 1)
+
+    def test_batched(self):
+        for edge_prob in [0.0, 1.0]:
+            np.random.seed(1)
+            data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+                edge_prob=edge_prob)
+            # The models share deps, so fit each to a different subset of rows
+            Ls = [data.L, data.L[:self.n // 2], data.L[self.n // 2:]]
+            label_model = BatchedLabelModel(self.m, k=self.k, p=data.p, 
+                deps=data.E)
+            label_model.train(Ls, n_epochs=1000, verbose=False)
+            self.assertEqual(label_model.mu.shape, (3, self.m * self.k, self.k))
+            c_probs_est = label_model.get_conditional_probs()
+            for i, L in enumerate(Ls):
+                err = np.mean(np.abs(data.c_probs - c_probs_est[i]))
+                self.assertLess(err, 0.015)
+
+            # Prediction should not reseed the global random state
+            rng_state = np.random.get_state()[1].copy()
+            Y_ps = label_model.predict_proba(Ls)
+            self.assertTrue((np.random.get_state()[1] == rng_state).all())
+            self.assertEqual(Y_ps[1].shape, (self.n // 2, self.k))
+            self.assertTrue(np.allclose(Y_ps[1], 
+                label_model.get_label_model(1).predict_proba(Ls[1])))
+            with self.assertRaises(NotImplementedError):
+                label_model.add_rows(data.L)
+
+    def test_moments_init(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k)
+        label_model = LabelModel(self.m, k=self.k, p=data.p)
+        label_model._generate_O(data.L)
+
+        # The closed-form init should be closer to the true params than random
+        errs = {}
+        for method in ['random', 'moments']:
+            label_model.update_config({'train_config': 
+                {'mu_init_method': method}})
+            label_model._init_params()
+            c_probs_est = label_model.get_conditional_probs()
+            errs[method] = np.mean(np.abs(data.c_probs - c_probs_est))
+        self.assertLess(errs['moments'], errs['random'])
+
+        # The estimated accuracies should be close to the empirical ones
+        _, accuracy = label_model._estimate_accuracies()
+        voted = data.L > 0
+        accuracy_true = ((data.L == data.Y.reshape(-1, 1)) & voted).sum(axis=0)
+        accuracy_true = accuracy_true / voted.sum(axis=0)
+        self.assertLess(np.mean(np.abs(accuracy - accuracy_true)), 0.05)
+
+        # Training from it recovers the params
+        label_model.train(data.L, n_epochs=500, verbose=False, 
+            mu_init_method='moments')
+        c_probs_est = label_model.get_conditional_probs()
+        err = np.mean(np.abs(data.c_probs - c_probs_est))
+        self.assertLess(err, 0.015)
+
+        # The init method of this model should not change the defaults
+        self.assertEqual(
+            LabelModel(self.m).config['train_config']['mu_init_method'], 
+            'random')
+
+    def test_O_inv(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+            edge_prob=1.0)
+        label_model = LabelModel(self.m, k=self.k, p=data.p, deps=data.E)
+        label_model.train(data.L, n_epochs=0, verbose=False)
+        O = label_model.O.double().numpy()
+        self.assertTrue(np.allclose(label_model.O_inv.numpy(), 
+            np.linalg.inv(O), atol=1e-3))
+        self.assertAlmostEqual(label_model.train_stats['O_inv']['cond'], 
+            np.linalg.cond(O), delta=1e-3 * np.linalg.cond(O))
+        
+        # A duplicated source makes O singular, which should fail fast unless
+        # O is regularized
+        L = data.L.copy()
+        L[:, 1] = L[:, 0]
+        label_model = LabelModel(self.m, k=self.k, p=data.p, deps=data.E)
+        with self.assertRaises(ValueError):
+            label_model.train(L, n_epochs=0, verbose=False)
+        label_model.train(L, n_epochs=0, verbose=False, inv_ridge=1e-3)
+        self.assertLess(label_model.train_stats['O_inv']['cond'], 1e8)
+
     def test_augmented_L_construction(self):
         # 5 LFs: a triangle, a connected edge to it, and a singleton source
         n = 3
@@ -87,18 +258,344 @@ class LabelModelTest(unittest.TestCase):
 
         # Finally, check the clique entries
         # Triangle clique
-        self.assertEqual(len(lm.c_tree.node[1]['members']), 3)
-        j = lm.c_tree.node[1]['start_index']
+        self.assertEqual(len(lm.c_tree.node[0]['members']), 3)
+        j = lm.c_tree.node[0]['start_index']
         self.assertEqual(L_aug[0, j], 1)
         self.assertEqual(L_aug[1, j + 3], 1)
         self.assertEqual(L_aug[2, j], 1)
         # Binary clique
-        self.assertEqual(len(lm.c_tree.node[2]['members']), 2)
-        j = lm.c_tree.node[2]['start_index']
+        self.assertEqual(len(lm.c_tree.node[1]['members']), 2)
+        j = lm.c_tree.node[1]['start_index']
         self.assertEqual(L_aug[0, j+1], 1)
         self.assertEqual(L_aug[1, j], 1)
         self.assertEqual(L_aug[2, j], 1)
     
+    def test_multi_task_augmented_L_construction(self):
+        # The sparse construction should match a dense reference
+        np.random.seed(1)
+        data = HierarchicalMultiTaskTreeDepsGenerator(1000, self.m)
+        lm = LabelModel(data.m, task_graph=data.task_graph, p=data.p)
+        L_aug = lm._get_augmented_label_matrix(data.L)
+        L = [np.asarray(L_s.todense()) for L_s in data.L]
+        Y = list(data.task_graph.feasible_set())
+        L_aug_dense = np.ones((1000, data.m * len(Y)))
+        for yi, y in enumerate(Y):
+            for s, L_s in enumerate(L):
+                L_aug_dense[:, yi::len(Y)] *= (L_s == y[s]) | (L_s == 0)
+            L_aug_dense[:, yi::len(Y)] *= sum(L) != 0
+        self.assertTrue(np.array_equal(L_aug.toarray(), L_aug_dense))
+
+    def test_sparse_O_construction(self):
+        # The overlaps matrix should match the dense construction for both
+        # dense and sparse inputs; values above k are ignored
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+2, size=(n, m))
+        L_aug_dense = np.zeros((n, m * k))
+        for y in range(1, k+1):
+            L_aug_dense[:, y-1::k] = np.where(L == y, 1, 0)
+        O_dense = L_aug_dense.T @ L_aug_dense / n
+
+        for L_in in [L, csr_matrix(L)]:
+            lm = LabelModel(m, k=k)
+            lm._generate_O(L_in)
+            self.assertEqual(lm.d, m * k)
+            np.testing.assert_array_almost_equal(lm.O.numpy(), O_dense)
+    
+    def test_chunked_O_construction(self):
+        # Accumulating O over row chunks should match a single pass
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+1, size=(n, m))
+        lm = LabelModel(m, k=k)
+        lm._generate_O(L)
+        O = lm.O.numpy()
+
+        lm_chunked = LabelModel(m, k=k)
+        lm_chunked._generate_O(csr_matrix(L[i:i+30]) for i in range(0, n, 30))
+        self.assertEqual(lm_chunked.n, n)
+        np.testing.assert_array_almost_equal(lm_chunked.O.numpy(), O)
+    
+    def test_parallel_O_construction(self):
+        # Reducing O over row shards in a process pool should match one pass
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+1, size=(n, m))
+        lm = LabelModel(m, k=k)
+        lm._generate_O(L)
+        O = lm.O.numpy()
+
+        for L_in in [L, csr_matrix(L), (L[i:i+30] for i in range(0, n, 30))]:
+            lm_parallel = LabelModel(m, k=k)
+            lm_parallel._generate_O(L_in, n_jobs=2)
+            self.assertEqual(lm_parallel.n, n)
+            np.testing.assert_array_almost_equal(lm_parallel.O.numpy(), O)
+    
+    def test_deduplicate_rows(self):
+        np.random.seed(1)
+        n, m, k = 1000, 4, 2
+        L = np.random.randint(0, k+1, size=(n, m))
+        lm = LabelModel(m, k=k)
+        L_unique, inverse, counts = lm._deduplicate_rows(csr_matrix(L))
+        self.assertEqual(L_unique.shape[0], len(np.unique(L, axis=0)))
+        self.assertEqual(counts.sum(), n)
+        np.testing.assert_array_equal(L_unique[inverse].toarray(), L)
+
+        # Training and prediction should not depend on deduplication
+        Y_ps = []
+        for dedup in [True, False]:
+            np.random.seed(1)
+            lm = LabelModel(m, k=k, deduplicate_rows=dedup)
+            lm.train(L, n_epochs=10, verbose=False)
+            Y_ps.append(lm.predict_proba(L))
+        np.testing.assert_array_almost_equal(Y_ps[0], Y_ps[1])
+    
+    def test_label_probs(self):
+        # The lookup-table inference should match the dense formula (which
+        # ignores values above k)
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+2, size=(n, m))
+        L[0] = 0
+        p = np.array([0.2, 0.3, 0.5])
+        lm = LabelModel(m, k=k, p=p)
+        lm.mu = torch.nn.Parameter(torch.rand(m * k, k))
+
+        L_aug = np.zeros((n, m * k))
+        for y in range(1, k+1):
+            L_aug[:, y-1::k] = np.where(L == y, 1, 0)
+        mu = np.clip(lm.mu.detach().numpy(), 0.01, 0.99)
+        X = np.exp(L_aug @ np.log(mu) + np.log(p))
+        Y_p = X / X.sum(axis=1).reshape(-1, 1)
+
+        for L_in in [L, csr_matrix(L)]:
+            Y_p_est = lm.get_label_probs(L_in)
+            np.testing.assert_array_almost_equal(Y_p_est, Y_p)
+            # All sources abstain in the first row, so it gets the prior
+            np.testing.assert_array_almost_equal(Y_p_est[0], p)
+    
+    def test_incremental_O(self):
+        # Adding rows or sources should match computing O from scratch
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+1, size=(n, m))
+        lm = LabelModel(m, k=k)
+        lm._generate_O(L)
+        O = lm.O.numpy()
+
+        lm_rows = LabelModel(m, k=k)
+        lm_rows.train(L[:60], n_epochs=10, verbose=False)
+        lm_rows.add_rows(csr_matrix(L[60:]))
+        self.assertEqual(lm_rows.n, n)
+        np.testing.assert_array_almost_equal(lm_rows.O.numpy(), O)
+
+        lm_sources = LabelModel(m - 2, k=k)
+        lm_sources.train(L[:, :m-2], n_epochs=10, verbose=False)
+        mu = lm_sources.mu.detach().clone()
+        self.assertFalse(hasattr(lm_sources.overlaps, 'L'))
+        lm_sources.add_sources(L[:, m-2:], L[:, :m-2])
+        self.assertEqual(lm_sources.m, m)
+        np.testing.assert_array_almost_equal(lm_sources.O.numpy(), O)
+
+        # Re-fitting with 0 epochs should just warm-start from the previous mu
+        lm_sources.train(warm_start=True, n_epochs=0, verbose=False)
+        self.assertEqual(lm_sources.mu.shape, (m * k, k))
+        self.assertTrue((lm_sources.mu[:(m-2)*k] == mu).all())
+    
+    def test_predict_proba_threaded(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+            edge_prob=1.0)
+        label_model = LabelModel(self.m, k=self.k, p=data.p, deps=data.E)
+        label_model.train(data.L, n_epochs=100, verbose=False)
+        c_data = label_model.c_data
+        Y_p = label_model.predict_proba(data.L)
+        Y_p_threaded = label_model.predict_proba(data.L, chunk_size=1000, 
+            n_threads=4)
+        self.assertTrue(np.allclose(Y_p, Y_p_threaded))
+
+        # Concurrent calls on a shared model should not interfere
+        Ls = [data.L[i::4] for i in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            Y_ps = list(pool.map(label_model.predict_proba, Ls))
+        for i, Y_p_i in enumerate(Y_ps):
+            self.assertTrue(np.allclose(Y_p_i, Y_p[i::4]))
+        self.assertIs(label_model.c_data, c_data)
+
+    def test_save_load(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+            edge_prob=1.0)
+        label_model = LabelModel(self.m, k=self.k, p=data.p, deps=data.E)
+        label_model.train(data.L, n_epochs=100, verbose=False)
+        Y_p = label_model.predict_proba(data.L)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for log_tables in [True, False]:
+                path = os.path.join(tmpdir, 'label_model.npz')
+                label_model.save(path, log_tables=log_tables)
+                lm = LabelModel.load(path)
+                self.assertEqual(lm.deps, label_model.deps)
+                self.assertEqual(lm.config, label_model.config)
+                self.assertEqual(
+                    [lm.c_tree.node[i]['members'] for i in lm.c_tree.nodes], 
+                    [label_model.c_tree.node[i]['members'] 
+                        for i in label_model.c_tree.nodes])
+                self.assertTrue(np.allclose(lm.predict_proba(data.L), Y_p))
+
+            # The loaded model can also be re-trained
+            lm.train(data.L, n_epochs=10, verbose=False)
+
+        # Multi-task
+        data = HierarchicalMultiTaskTreeDepsGenerator(1000, self.m)
+        label_model = LabelModel(data.m, task_graph=data.task_graph, p=data.p)
+        label_model.train(data.L, n_epochs=10, verbose=False)
+        f = io.BytesIO()
+        label_model.save(f)
+        f.seek(0)
+        lm = LabelModel.load(f)
+        self.assertTrue(lm.task_graph == label_model.task_graph)
+        self.assertTrue(np.allclose(lm.predict_proba(data.L), 
+            label_model.predict_proba(data.L)))
+
+    def test_predictor(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k, 
+            edge_prob=1.0)
+        label_model = LabelModel(self.m, k=self.k, p=data.p, deps=data.E)
+        label_model.train(data.L, n_epochs=100, verbose=False)
+        Y_p = label_model.predict_proba(data.L)
+        predictor = label_model.export_predictor()
+        self.assertTrue(np.allclose(predictor.predict_proba(data.L), Y_p))
+
+        # The predictor can also be loaded from a saved LabelModel
+        f = io.BytesIO()
+        label_model.save(f, log_tables=False)
+        f.seek(0)
+        predictor = LabelModelPredictor.load(f)
+        self.assertTrue(np.allclose(predictor.predict_proba(data.L), Y_p))
+
+        # Multi-task
+        data = HierarchicalMultiTaskTreeDepsGenerator(1000, self.m)
+        label_model = LabelModel(data.m, task_graph=data.task_graph, p=data.p)
+        label_model.train(data.L, n_epochs=10, verbose=False)
+        f = io.BytesIO()
+        label_model.save(f)
+        f.seek(0)
+        predictor = LabelModelPredictor.load(f)
+        self.assertTrue(np.allclose(predictor.predict_proba(data.L), 
+            label_model.predict_proba(data.L)))
+
+        # Importing the predictor should not import torch
+        code = ("import sys; import metal.label_model.predictor; "
+            "sys.exit(any(mod in sys.modules "
+            "for mod in ['torch', 'matplotlib', 'pandas']))")
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+    def test_prediction_cache(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(self.n, self.m, k=self.k)
+        label_model = LabelModel(self.m, k=self.k, p=data.p)
+        label_model.train(data.L, n_epochs=100, verbose=False)
+        Y_p = label_model.predict_proba(data.L)
+        self.assertIsNone(label_model.prediction_cache_info())
+
+        label_model.update_config({'prediction_cache_size': 10})
+        L = csr_matrix(data.L)
+        for i in range(20):
+            self.assertTrue(np.allclose(label_model.predict_proba(L[i % 5]), 
+                Y_p[i % 5]))
+        info = label_model.prediction_cache_info()
+        self.assertEqual(info['misses'], len(set(map(str, data.L[:5]))))
+        self.assertEqual(info['hits'], 20 - info['misses'])
+
+        # Batches are only evaluated on the uncached patterns, and evicted LRU
+        self.assertTrue(np.allclose(label_model.predict_proba(data.L), Y_p))
+        info = label_model.prediction_cache_info()
+        self.assertEqual(info['size'], 10)
+        # The cached rows do not keep the batch results alive
+        cache = label_model._get_prediction_cache()
+        self.assertTrue(all(Y_i.base is None 
+            for Y_i in cache._entries.values()))
+
+        # Retraining invalidates the cache
+        label_model.train(data.L, n_epochs=10, verbose=False)
+        self.assertEqual(label_model.prediction_cache_info()['size'], 0)
+
+        # Multi-task
+        data = HierarchicalMultiTaskTreeDepsGenerator(1000, self.m)
+        label_model = LabelModel(data.m, task_graph=data.task_graph, p=data.p)
+        label_model.train(data.L, n_epochs=10, verbose=False)
+        Y_p = label_model.predict_proba(data.L)
+        label_model.update_config({'prediction_cache_size': 100})
+        for _ in range(2):
+            self.assertTrue(np.allclose(label_model.predict_proba(data.L), 
+                Y_p))
+        self.assertGreater(label_model.prediction_cache_info()['hits'], 0)
+
+    def test_majority_label_voter(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(1000, self.m, k=3)
+        L = csr_matrix(data.L)
+        
+        # Compare against a per-row count of the votes
+        Y_p = np.zeros((L.shape[0], 3))
+        for i, row in enumerate(data.L.astype(int)):
+            counts = np.bincount(row[row > 0] - 1, minlength=3)
+            Y_p[i] = np.where(counts == counts.max(), 1, 0)
+        Y_p /= Y_p.sum(axis=1).reshape(-1, 1)
+        voter = MajorityLabelVoter(self.m, k=3)
+        voter.train(L)
+        self.assertTrue(np.allclose(voter.predict_proba(L), Y_p))
+        self.assertTrue(np.allclose(voter.predict_proba(data.L, 
+            chunk_size=100), Y_p))
+        self.assertTrue(np.allclose(voter.predict_proba(
+            L[i:i+300] for i in range(0, 1000, 300)), Y_p))
+
+        # With a dominant weight, the votes of LF 0 win wherever it votes
+        weights = np.ones(self.m)
+        weights[0] = 100
+        voter.train(L, weights=weights)
+        Y_p = voter.predict_proba(L)
+        voted = data.L[:, 0] > 0
+        self.assertTrue(np.all(Y_p[voted].argmax(axis=1) + 1 == 
+            data.L[voted, 0]))
+
+    def test_predict_task_proba(self):
+        np.random.seed(1)
+        data = HierarchicalMultiTaskTreeDepsGenerator(1000, self.m)
+        label_model = LabelModel(data.m, task_graph=data.task_graph, p=data.p)
+        label_model.train(data.L, n_epochs=100, verbose=False)
+        Y_p = label_model.predict_proba(data.L)
+        Y_tps = label_model.predict_proba(data.L, marginalize=True)
+        self.assertEqual(len(Y_tps), data.task_graph.t)
+
+        # Compare to marginalizing in a loop over the feasible set
+        for t, K_t in enumerate(data.task_graph.K_t):
+            Y_tp = np.zeros((1000, K_t))
+            for yi, y in enumerate(data.task_graph.feasible_set()):
+                if y[t] > 0:
+                    Y_tp[:, int(y[t]) - 1] += Y_p[:, yi]
+            self.assertTrue(np.allclose(Y_tps[t], Y_tp))
+            self.assertTrue(np.allclose(
+                label_model.predict_task_proba(data.L, t=t), Y_tp))
+
+    def test_predict_proba_chunked(self):
+        np.random.seed(1)
+        n, m, k = 100, 5, 3
+        L = np.random.randint(0, k+1, size=(n, m))
+        lm = LabelModel(m, k=k)
+        lm.mu = torch.nn.Parameter(torch.rand(m * k, k))
+        Y_p = lm.predict_proba(L)
+
+        Y_p_chunks = list(lm.predict_proba_iter(csr_matrix(L), chunk_size=30))
+        self.assertEqual(len(Y_p_chunks), 4)
+        np.testing.assert_array_almost_equal(np.vstack(Y_p_chunks), Y_p)
+
+        out = np.zeros((n, k))
+        Y_p_out = lm.predict_proba(L, out=out, chunk_size=30)
+        self.assertIs(Y_p_out, out)
+        np.testing.assert_array_almost_equal(out, Y_p)
+    
     def test_with_deps(self):
         for seed in range(self.n_iters):
             np.random.seed(seed)
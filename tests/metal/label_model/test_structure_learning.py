@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from metal.label_model.graph_utils import get_clique_tree
+from metal.label_model.label_model import LabelModel
+from metal.label_model.structure_learning import learn_deps
+from synthetics.generate import SingleTaskTreeDepsGenerator
+
+
+class StructureLearningTest(unittest.TestCase):
+
+    def test_no_deps(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(10000, 10, k=2)
+        label_model = LabelModel(data.m, k=data.k, p=data.p)
+        # Conditionally independent sources should have no dependencies
+        self.assertEqual(label_model.learn_deps(data.L), [])
+
+    def test_tree_deps(self):
+        np.random.seed(1)
+        data = SingleTaskTreeDepsGenerator(10000, 10, k=2, edge_prob=1.0,
+            theta_edge_range=(2, 3))
+        label_model = LabelModel(data.m, k=data.k, p=data.p)
+        label_model._generate_O(data.L)
+        deps = learn_deps(label_model.O.numpy(), data.m, data.k, 
+            thresh=0.0, max_deps=len(data.E))
+        self.assertEqual(len(deps), len(data.E))
+        for i, j in deps:
+            self.assertLess(i, j)
+
+        # Most of the top scoring pairs should be true dependencies
+        true_deps = {tuple(sorted(e)) for e in data.E}
+        recall = len(set(deps) & true_deps) / len(true_deps)
+        self.assertGreaterEqual(recall, 0.5)
+
+        # The learned deps define a valid clique tree, and can be reused
+        get_clique_tree(range(data.m), deps)
+        self.assertEqual(label_model.learn_deps(thresh=0.0, 
+            max_deps=len(data.E)), deps)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import sys
 import unittest
 
+import numpy as np
+
 from metal.multitask.task_graph import TaskHierarchy, SingleTaskGraph
 
 class TaskGraphTest(unittest.TestCase):
@@ -46,6 +48,36 @@ class TaskGraphTest(unittest.TestCase):
         self.assertTrue(tg.children[1] == [2])
         # self.assertTrue(tg.depth == 2)
 
+
+    def test_feasible_set(self):
+        cardinalities = [2,2,2]
+        edges = [(0,1), (0,2)]
+        tg = TaskHierarchy(edges, cardinalities)
+        Y = np.array(list(tg.feasible_set()))
+        self.assertEqual(len(tg), 4)
+        self.assertTrue(np.array_equal(Y, 
+            [[1,1,-1], [1,2,-1], [2,-1,1], [2,-1,2]]))
+        self.assertTrue(tg.is_feasible([2,-1,1]))
+        self.assertFalse(tg.is_feasible([2,1,-1]))
+        self.assertEqual(tg.get_feasible_index(np.array([2,-1,2])), 3)
+
+        # Vectorized over an N x T array of label vectors
+        Y_test = np.array([[1,2,-1], [1,-1,1], [2,-1,1], [1,3,-1], [0,0,0]])
+        self.assertTrue(np.array_equal(tg.is_feasible(Y_test), 
+            [True, False, True, False, False]))
+        self.assertTrue(np.array_equal(tg.get_feasible_index(Y_test), 
+            [1, -1, 2, -1, -1]))
+
+        # Non-integer label vectors are infeasible, rather than truncated
+        self.assertFalse(tg.is_feasible([1.5,1,-1]))
+        self.assertTrue(np.array_equal(tg.is_feasible(
+            np.array([[1.5,1,-1], [1,1,-1]])), [False, True]))
+
+        # feasible_set yields new arrays, so callers may modify them
+        y = next(tg.feasible_set())
+        y[0] = 2
+        self.assertEqual(tg.feasible_array[0, 0], 1)
+
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -45,6 +45,9 @@ class UtilsTest(unittest.TestCase):
         w = recursive_merge_dicts(x, y, verbose=False)
         self.assertEqual(w['bar'], 5)
         self.assertEqual(w['foo']['Foo']['FOO'], 4)
+        # x itself (including its nested dicts) is not modified
+        self.assertEqual(x['foo']['Foo']['FOO'], 1)
+        self.assertEqual(x['bar'], 2)
         with self.assertRaises(ValueError):
             recursive_merge_dicts(x, z, verbose=False)
             